@@ -0,0 +1,175 @@
+import hashlib
+import time
+
+
+class AdmissionRejected(Exception):
+    """A request was over a rate or concurrency limit; it may be retried after `retry_after` seconds."""
+
+    def __init__(self, scope, key, reason, retry_after):
+        # Tokens are secrets, so are not named in the message
+        super(AdmissionRejected, self).__init__(f"Too many {reason} for {scope} {key}"
+                                                if scope != 'token' else
+                                                f"Too many {reason} for this token")
+        self.scope = scope
+        self.key = key
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Limit(object):
+    """Token bucket level and requests in flight for one key."""
+    __slots__ = ('level', 'updated', 'in_flight')
+
+    def __init__(self, level, now):
+        self.level = level
+        self.updated = now
+        self.in_flight = 0
+
+
+class Limiter(object):
+    """A token bucket rate limit and a concurrency cap, applied separately to each key.
+
+    Each key may make `rate` requests per second on average, in bursts of up to `burst`, with
+    at most `concurrency` in flight at once. A zero setting disables that limit.
+    """
+
+    def __init__(self, scope, rate=0, burst=0, concurrency=0):
+        self.scope = scope
+        self.rate = 0.0
+        self._limits = {}  # key -> _Limit
+        self._purge_at = 1024
+        self.configure(rate, burst, concurrency)
+
+    def configure(self, rate=0, burst=0, concurrency=0):
+        rate, burst, concurrency = float(rate), float(burst), int(concurrency)
+        if rate < 0 or burst < 0 or concurrency < 0:
+            raise ValueError(f"{self.scope} rate, burst and concurrency must not be negative")
+        # A bucket must hold at least one request
+        burst = max(burst, 1.0) if rate else 0.0
+        for limit in self._limits.values():
+            # Buckets were not drawn from while there was no rate limit
+            limit.level = min(limit.level, burst) if self.rate else burst
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+
+    def check(self, key, now):
+        """Raise AdmissionRejected unless `key` may make a request now."""
+        limit = self._refill(key, now)
+        if limit is None:
+            return
+        if self.concurrency and limit.in_flight >= self.concurrency:
+            # No way of knowing when a request will finish, so suggest a short wait
+            raise AdmissionRejected(self.scope, key, 'concurrent requests', 1)
+        if self.rate and limit.level < 1:
+            raise AdmissionRejected(self.scope, key, 'requests', (1 - limit.level) / self.rate)
+
+    def acquire(self, key, now):
+        limit = self._limits.get(key)
+        if limit is None:
+            if len(self._limits) >= self._purge_at:
+                self._purge(now)
+            limit = self._limits[key] = _Limit(self.burst, now)
+        if self.rate:
+            limit.level -= 1
+        limit.in_flight += 1
+
+    def release(self, key):
+        limit = self._limits.get(key)
+        if limit is not None:
+            limit.in_flight -= 1
+
+    def utilization(self, now, keys=None):
+        """Return the use of each key's limits, for `keys` or all keys seen recently."""
+        report = {}
+        for key in (self._limits if keys is None else keys):
+            limit = self._refill(key, now)
+            report[key] = {'in_flight': limit.in_flight if limit else 0,
+                           'concurrency': self.concurrency or None,
+                           'available': round(limit.level if limit else self.burst, 3)
+                                        if self.rate else None,
+                           'burst': self.burst or None}
+        return report
+
+    def _refill(self, key, now):
+        limit = self._limits.get(key)
+        if limit is not None and self.rate:
+            limit.level = min(self.burst, limit.level + (now - limit.updated) * self.rate)
+        if limit is not None:
+            limit.updated = now
+        return limit
+
+    def _purge(self, now):
+        """Drop keys with nothing in flight and a full bucket, which are no different from new ones."""
+        for key in list(self._limits):
+            limit = self._refill(key, now)
+            if not limit.in_flight and limit.level >= self.burst:
+                del self._limits[key]
+        self._purge_at = max(1024, 2 * len(self._limits))
+
+
+class Admission(object):
+    """Limits held by an admitted request, released on leaving the `with` block."""
+
+    def __init__(self, holds):
+        self._holds = holds  # [(limiter, key)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def release(self):
+        for limiter, key in self._holds:
+            limiter.release(key)
+        self._holds = []
+
+
+class AdmissionControl(object):
+    """Rate and concurrency limits per API token and per target platform.
+
+    A request is only admitted if it is within the limits of its token and of every platform it
+    targets, in which case it counts against all of them until released.
+    """
+
+    def __init__(self, **settings):
+        self.tokens = Limiter('token')
+        self.platforms = Limiter('platform')
+        self.configure(**settings)
+
+    def configure(self, token_rate=0, token_burst=0, token_concurrency=0,
+                  platform_rate=0, platform_burst=0, platform_concurrency=0):
+        # Validate both before applying either
+        tokens = Limiter('token', token_rate, token_burst, token_concurrency)
+        platforms = Limiter('platform', platform_rate, platform_burst, platform_concurrency)
+        self.tokens.configure(tokens.rate, tokens.burst, tokens.concurrency)
+        self.platforms.configure(platforms.rate, platforms.burst, platforms.concurrency)
+
+    def admit(self, token, platforms=()):
+        """Admit a request, returning its `Admission`. Raises AdmissionRejected if over a limit."""
+        now = time.time()
+        holds = [(self.tokens, token)] + [(self.platforms, platform) for platform in set(platforms)]
+        for limiter, key in holds:
+            limiter.check(key, now)
+        for limiter, key in holds:
+            limiter.acquire(key, now)
+        return Admission(holds)
+
+    def utilization(self, token=None):
+        """Return the use of the limits of every platform and token seen recently.
+
+        Tokens are reported by a short hash, so that they are not revealed. The use of `token`'s
+        own limits is also reported under `token`.
+        """
+        now = time.time()
+        report = {'platforms': self.platforms.utilization(now),
+                  'tokens': {token_id(key): use for key, use in self.tokens.utilization(now).items()}}
+        if token is not None:
+            report['token'] = self.tokens.utilization(now, [token])[token]
+        return report
+
+
+def token_id(token):
+    """A short name for an API token which does not reveal it."""
+    return hashlib.sha256(str(token).encode('utf-8')).hexdigest()[:12]
@@ -4,13 +4,43 @@ Agent documentation goes here.
 
 __docformat__ = 'reStructuredText'
 
+import bisect
+import functools
+import gevent
+import gevent.event
+import gevent.pool
+import hashlib
+import itertools
 import json
 import logging
+import math
+import os
 import requests
 import sys
+import time
+from collections import Counter, deque
+from datetime import timedelta
+from urllib.parse import parse_qs
+from .admission import AdmissionControl, AdmissionRejected
+from .credential_verifier import CACHED, VALID, CredentialVerifier
+from .device_index import DeviceIndex
+from .device_registry import DeviceRegistry, PlatformDevices
+from .encoding import EncodedResponse, EncodedResponseCache, dumps, encode_response, loads, negotiate
+from .history import (AGGREGATES, chunk_ranges, downsample, format_time, parse_duration, parse_time,
+                      to_columns)
+from .last_value_store import LastValueStore
+from .metadata_cache import MetadataCache
+from .metrics import Metrics
+from .platform_health import CircuitOpen, PlatformHealth, UnknownPlatform
+from .paging import build_json_object, iter_devices, iter_json_object, parse_page_params, take_page
+from .push import PushHub
+from .single_flight import SingleFlight
+from .snapshot import load_snapshot, save_snapshot
 from .token_handler import TokenHandler
+from .write_pipeline import WritePipeline
 from volttron.platform.agent import utils
 from volttron.platform.agent.known_identities import *
+from volttron.platform.jsonrpc import RemoteError
 from volttron.platform.vip.agent import Agent, Core, RPC
 
 
@@ -18,6 +48,15 @@ _log = logging.getLogger(__name__)
 utils.setup_logging()
 __version__ = "0.1"
 
+# Platform driver and historian methods which only read, so identical concurrent calls can share
+# one result
+COALESCED_DRIVER_METHODS = {'get_point', 'scrape_all', 'get_multiple_points', 'query'}
+# VCP agent methods, likewise
+COALESCED_PLATFORM_METHODS = {'get_devices', 'list_agents'}
+
+# Topic prefixes reserved for the platform, which may not be published on through the API
+DENIED_PUBLISH_PREFIXES = ('devices/', 'heartbeat/', 'alerts/', 'platform/')
+
 
 def UIAPIAgent(config_path, **kwargs):
     """Parses the Agent configuration and returns an instance of
@@ -39,20 +78,72 @@ def UIAPIAgent(config_path, **kwargs):
 
     setting1 = int(config.get('setting1', 1))
     setting2 = config.get('setting2', "some/random/topic")
+    metadata_cache = dict(config.get('metadata_cache', {}))
+    platform_calls = dict(config.get('platform_calls', {}))
+    last_values = dict(config.get('last_values', {}))
+    tokens = dict(config.get('tokens', {}))
+    metrics = dict(config.get('metrics', {}))
+    push = dict(config.get('push', {}))
+    responses = dict(config.get('responses', {}))
+    single_flight = dict(config.get('single_flight', {}))
+    writes = dict(config.get('writes', {}))
+    admission = dict(config.get('admission', {}))
+    history = dict(config.get('history', {}))
+    circuit_breaker = dict(config.get('circuit_breaker', {}))
+    snapshot = dict(config.get('snapshot', {}))
+    calls = dict(config.get('calls', {}))
+    publish = dict(config.get('publish', {}))
+    credentials = dict(config.get('credentials', {}))
 
     return Uiapiagent(setting1,
                           setting2,
+                          metadata_cache,
+                          platform_calls,
+                          last_values,
+                          tokens,
+                          metrics,
+                          push,
+                          responses,
+                          single_flight,
+                          writes,
+                          admission,
+                          history,
+                          circuit_breaker,
+                          snapshot,
+                          calls,
+                          publish,
+                          credentials,
                           **kwargs)
 
 
-def format_response(code, body=None):
+def format_response(code, body=None, headers=None):
     response_code = {
         200: {
             'code':   '200 OK',
-            'body':   body if isinstance(body, str) else json.dumps(body),
+            'body':   body if isinstance(body, str) else dumps(body),
+            'header': [('Content-Type', 'application/json'),
+                       ('Access-Control-Allow-Origin', '*')] + (headers or [])
+
+        },
+
+        202: {
+            'code':   '202 Accepted',
+            'body':   dumps(body),
+            'header': [('Content-Type', 'application/json'),
+                       ('Access-Control-Allow-Origin', '*')] + (headers or [])
+        },
+
+        404: {
+            'code':   '404 Not Found',
+            'body':   json.dumps({'message': body}) if body else '{"message": "Not found"}',
             'header': [('Content-Type', 'application/json'),
                        ('Access-Control-Allow-Origin', '*')]
+        },
 
+        304: {
+            'code':   '304 Not Modified',
+            'body':   '',
+            'header': [('Access-Control-Allow-Origin', '*')] + (headers or [])
         },
 
         401: {
@@ -65,11 +156,32 @@ def format_response(code, body=None):
 
         400: {
             'code':   '400 Bad Request',
-            'body':   '{"message": "Internal Error: Bad Code"}',
+            'body':   json.dumps({'message': body}) if body else '{"message": "Internal Error: Bad Code"}',
+            'header': [('Content-Type', 'application/json'),
+                       ('Access-Control-Allow-Origin', '*')]
+        },
+
+        503: {
+            'code':   '503 Service Unavailable',
+            'body':   json.dumps({'message': body}) if body else '{"message": "Service unavailable"}',
+            'header': [('Content-Type', 'application/json'),
+                       ('Access-Control-Allow-Origin', '*')] + (headers or [])
+        },
+
+        504: {
+            'code':   '504 Gateway Timeout',
+            'body':   json.dumps({'message': body}) if body else '{"message": "Timed out"}',
             'header': [('Content-Type', 'application/json'),
                        ('Access-Control-Allow-Origin', '*')]
         },
 
+        429: {
+            'code':   '429 Too Many Requests',
+            'body':   json.dumps({'message': body}) if body else '{"message": "Too many requests"}',
+            'header': [('Content-Type', 'application/json'),
+                       ('Access-Control-Allow-Origin', '*')] + (headers or [])
+        },
+
         'preflight': {
             'code':   '200 OK',
             'body':   '',
@@ -84,6 +196,71 @@ def format_response(code, body=None):
     except KeyError:
         return list(response_code[400].values())
 
+
+def cache_headers(etag):
+    """Headers letting clients keep a response and revalidate it with If-None-Match."""
+    return [('ETag', etag), ('Cache-Control', 'private, no-cache')]
+
+
+def etag_matches(env, etag):
+    """Whether the request's If-None-Match header names `etag`."""
+    if_none_match = env.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match or etag is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+def _valid_patterns(patterns):
+    return isinstance(patterns, list) and all(isinstance(p, str) and p for p in patterns)
+
+
+def names_unknown_agent(error, agent_uuid):
+    """Whether a RemoteError from routing a call to `agent_uuid` says that agent is not known.
+
+    Errors raised by the agent itself, e.g. for an unknown point, do not mention its UUID.
+    """
+    exc_info = getattr(error, 'exc_info', None) or {}
+    text = f"{exc_info.get('exc_type', '')} {error}"
+    return (agent_uuid in text or 'Unreachable' in text or
+            any(phrase in text.lower() for phrase in ('unknown peer', 'no route', 'not running')))
+
+
+def request_token(env):
+    """Return the API token the request was made with, or None."""
+    try:
+        auth_type, token = env['HTTP_AUTHORIZATION'].split()
+        return token if auth_type.upper() == "BASIC" else None
+    except (KeyError, ValueError):
+        return None
+
+
+def body_lines(data):
+    """Yield the lines of a request body, numbered from 1.
+
+    The web service passes endpoints the whole body over RPC, not the WSGI input stream, so
+    the body is held in memory; it is split into lines without copying it whole. A body the
+    web service has already decoded as JSON is yielded as one record per list item.
+    """
+    if isinstance(data, (str, bytes)):
+        newline = '\n' if isinstance(data, str) else b'\n'
+        start, number = 0, 0
+        while start < len(data):
+            end = data.find(newline, start)
+            end = len(data) if end < 0 else end
+            number += 1
+            yield number, data[start:end]
+            start = end + 1
+    elif isinstance(data, list):
+        yield from enumerate(data, 1)
+    elif isinstance(data, dict):
+        yield 1, data
+
+
+def query_params(env):
+    """Return the request's query string as a dict, keeping the last value given for each key."""
+    return {key: values[-1] for key, values in parse_qs(env.get('QUERY_STRING', '')).items()}
+
 # TODO: Refactor to match RPC.export implementation
 _agent_routes = []
 def agent_route(route_regex):
@@ -97,7 +274,7 @@ def agent_route(route_regex):
     def register_agent_route(method):
         # Must store names to avoid method vs. function weirdness
         _agent_routes.append((route_regex, method.__name__))
-        return method
+        return _instrumented(route_regex, method, raw=False)
     return register_agent_route
 
 _agent_endpoints = []
@@ -111,17 +288,55 @@ def endpoint(endpoint_path):
     def register_endpoint(method):
         # Must store names to avoid method vs. function weirdness
         _agent_endpoints.append((endpoint_path, method.__name__))
-        return method
+        return _instrumented(endpoint_path, method, raw=True)
     return register_endpoint
 
+def _instrumented(path, method, raw):
+    '''Wrap an endpoint or agent route handler to record its latency in the agent's metrics.
+
+    Calls to a platform which is down or too slow are answered with `503` or `504` here, and
+    calls to one which is not connected with `404`.
+    Responses other than `[status, body, headers]` lists and strings are JSON encoded here
+    (rather than by the web service) so that encoding time is measured as well. Endpoints are registered as `raw`, so their responses are also compressed
+    as the client accepts and base64 encoded here; agent routes cannot carry binary bodies.
+    '''
+    @functools.wraps(method)
+    def handler(self, env, data):
+        with self._metrics.time_request(path) as trace:
+            try:
+                response = method(self, env, data)
+            except CircuitOpen as e:
+                response = format_response(503, str(e),
+                                           [('Retry-After', str(max(1, math.ceil(e.retry_after))))])
+            except UnknownPlatform as e:
+                response = format_response(404, str(e))
+            except gevent.Timeout:
+                response = format_response(504, "Timed out waiting for the platform")
+            if not isinstance(response, (list, str)):
+                # Any other JSON value: a dict, or e.g. the bool answering `DELETE /auth`
+                with self._metrics.time_serialize(path):
+                    response = format_response(200, response)
+            if raw and not isinstance(response, EncodedResponse):
+                if isinstance(response, str):
+                    response = ['200 OK', response, [('Content-Type', 'text/html'),
+                                                     ('Access-Control-Allow-Origin', '*')]]
+                with self._metrics.time_serialize(path):
+                    response = self._encode_response(env, response)
+            trace.status = response[0] if isinstance(response, list) else '200 OK'
+            return response
+    return handler
+
 
 class Uiapiagent(Agent):
     """
     Document agent constructor here.
     """
 
-    def __init__(self, setting1=1, setting2="some/random/topic",
-                 **kwargs):
+    def __init__(self, setting1=1, setting2="some/random/topic", metadata_cache=None,
+                 platform_calls=None, last_values=None, tokens=None, metrics=None, push=None,
+                 responses=None, single_flight=None, writes=None, admission=None,
+                 history=None, circuit_breaker=None, snapshot=None,
+                 calls=None, publish=None, credentials=None, **kwargs):
         super(Uiapiagent, self).__init__(enable_web=True, **kwargs)
         _log.debug("vip_identity: " + self.core.identity)
 
@@ -129,9 +344,106 @@ class Uiapiagent(Agent):
         self.setting2 = setting2
 
         self.default_config = {"setting1": setting1,
-                               "setting2": setting2}
+                               "setting2": setting2,
+                               "metadata_cache": metadata_cache or {},
+                               "platform_calls": platform_calls or {},
+                               "last_values": last_values or {},
+                               "tokens": tokens or {},
+                               "metrics": metrics or {},
+                               "push": push or {},
+                               "responses": responses or {},
+                               "single_flight": single_flight or {},
+                               "writes": writes or {},
+                               "admission": admission or {},
+                               "history": history or {},
+                               "circuit_breaker": circuit_breaker or {},
+                               "snapshot": snapshot or {},
+                               "calls": calls or {},
+                               "publish": publish or {},
+                               "credentials": credentials or {}}
+
+        # Maximum platforms queried at once, and seconds allowed for each platform
+        self.platform_concurrency = 8
+        self.platform_timeout = 10.0
+        # Maximum devices scraped at once when reading all devices under a topic prefix
+        self.scrape_concurrency = 16
+        # Seconds allowed for each call to a platform, by method name (`call_timeout` otherwise),
+        # and seconds after which a read is repeated if still unanswered: a number, 'p95' for the
+        # platform's recent 95th percentile latency, or None to never repeat reads
+        self.call_timeout = 10.0
+        self.call_deadlines = {}
+        self.hedge_after = None
+        self._health = PlatformHealth()
+
+        # Point values published by the local platform's drivers, served instead of scraping
+        # while younger than `last_values_max_age` seconds.
+        self._last_values = LastValueStore()
+        self.last_values_platform = None
+        self.last_values_max_age = 60.0
 
         self._auth = TokenHandler()
+        self._credentials = CredentialVerifier()
+        self._metadata_cache = MetadataCache()
+        # Device topics and point names of every platform, kept in step with the hierarchy
+        self._device_index = DeviceIndex()
+        # Builds the compact PlatformDevices which each platform's devices are cached as
+        self._devices = DeviceRegistry()
+        self._metrics = Metrics()
+        self._push = PushHub(self._send_push, self._unregister_push, '/devices/push')
+
+        # Bodies of at least `compress_min_size` bytes are compressed if the client accepts it.
+        # Encoded responses with an ETag are kept for reuse while the ETag stays current.
+        self.compress_min_size = 1024
+        self.compress_level = 6
+        self._encoded_responses = EncodedResponseCache()
+        # Cache generations restart with the agent, so ETags derived from them also carry an
+        # epoch unique to this run
+        self._etag_epoch = os.urandom(8).hex()
+
+        # Identical reads in flight at the same time, per platform, share a single call
+        self._single_flight = SingleFlight()
+
+        # Point writes are debounced and batched per device. They may go through the actuator,
+        # holding a schedule of `schedule_duration` seconds per device which is reused while current.
+        self._writes = WritePipeline(self._write_device)
+        self.writes_use_actuator = False
+        self.schedule_duration = 300.0
+        self.schedule_priority = 'LOW'
+        self._schedules = {}  # (platform, device) -> end of the schedule held, as aware datetime
+
+        # Rate and concurrency limits on device requests, per API token and per target platform
+        self._admission = AdmissionControl()
+
+        # Platform metadata and device lists are saved to `snapshot_path` every
+        # `snapshot_interval` seconds and on shutdown, and loaded on startup if younger than
+        # `snapshot_max_age` seconds
+        self.snapshot_path = None
+        self.snapshot_interval = 300.0
+        self.snapshot_max_age = 86400.0
+        self._snapshot_loop = None
+
+        # Requests to `/calls` may hold at most `calls_max` calls, run `calls_concurrency` at once,
+        # with call timeouts of at least `calls_min_timeout` seconds
+        self.calls_max = 1000
+        self.calls_concurrency = 32
+        self.calls_min_timeout = 1.0
+
+        # Bulk publishes are read in batches of `publish_batch_size` lines, with at most
+        # `publish_max_in_flight` publishes waiting on the message bus at once
+        self.publish_batch_size = 500
+        self.publish_max_in_flight = 64
+        self.publish_max_errors = 100
+        # Topics which may not be published on through the API, such as driver publishes which
+        # feed the last value store, and if set the only topics which may be
+        self.publish_denied_prefixes = DENIED_PUBLISH_PREFIXES
+        self.publish_allowed_prefixes = None
+
+        # Historian queries are split into ranges of `history_chunk_seconds` fetched concurrently,
+        # each in pages of `history_page_size` rows, and may cover at most `history_max_chunks`
+        self.history_chunk_seconds = 21600.0
+        self.history_page_size = 1000
+        self.history_max_buckets = 10000
+        self.history_max_chunks = 120
 
         #Set a default configuration to ensure that self.configure is called immediately to setup
         #the agent.
@@ -152,14 +464,142 @@ class Uiapiagent(Agent):
         _log.debug("Configuring Agent")
 
         try:
+            # Every other setting is a section of settings, which may be left null
+            for section, default in self.default_config.items():
+                if isinstance(default, dict):
+                    config[section] = config.get(section) or {}
+                    if not isinstance(config[section], dict):
+                        raise ValueError(f"{section} must be an object of settings")
             setting1 = int(config["setting1"])
             setting2 = str(config["setting2"])
-        except ValueError as e:
+            # Components are checked on throwaway instances first, so that nothing is applied
+            # unless the whole configuration is valid
+            MetadataCache().configure(**config["metadata_cache"])
+            TokenHandler().configure(**dict(config["tokens"], persist_path=None))
+            CredentialVerifier().configure(**config["credentials"])
+            Metrics().configure(**config["metrics"])
+            PushHub(None, None, '').configure(**config["push"])
+            SingleFlight().configure(**config["single_flight"])
+            AdmissionControl().configure(**config["admission"])
+            writes = {"window": config["writes"].get("window", 0.1),
+                      "ticket_ttl": config["writes"].get("ticket_ttl", 300)}
+            WritePipeline(None).configure(**writes)
+            PlatformHealth().configure(**config["circuit_breaker"])
+            snapshot_path = config["snapshot"].get("path") or None
+            snapshot_interval = float(config["snapshot"].get("interval", 300))
+            snapshot_max_age = float(config["snapshot"].get("max_age", 86400))
+            if snapshot_interval <= 0 or snapshot_max_age <= 0:
+                raise ValueError("snapshot interval and max_age must be positive")
+            calls_max = int(config["calls"].get("max_calls", 1000))
+            calls_concurrency = int(config["calls"].get("concurrency", 32))
+            calls_min_timeout = float(config["calls"].get("min_timeout", 1))
+            if calls_max < 1 or calls_concurrency < 1 or calls_min_timeout <= 0:
+                raise ValueError("calls max_calls, concurrency and min_timeout must be positive")
+            publish_batch_size = int(config["publish"].get("batch_size", 500))
+            publish_max_in_flight = int(config["publish"].get("max_in_flight", 64))
+            publish_max_errors = int(config["publish"].get("max_errors", 100))
+            if publish_batch_size < 1 or publish_max_in_flight < 1 or publish_max_errors < 0:
+                raise ValueError("publish batch_size and max_in_flight must be positive")
+            publish_denied_prefixes = config["publish"].get("denied_prefixes",
+                                                            DENIED_PUBLISH_PREFIXES)
+            publish_allowed_prefixes = config["publish"].get("allowed_prefixes")
+            for prefixes in (publish_denied_prefixes, publish_allowed_prefixes or []):
+                if not (isinstance(prefixes, (list, tuple)) and
+                        all(isinstance(prefix, str) and prefix for prefix in prefixes)):
+                    raise ValueError("publish denied_prefixes and allowed_prefixes must be lists "
+                                     "of topic prefixes")
+            history_chunk_seconds = float(config["history"].get("chunk_seconds", 21600))
+            history_page_size = int(config["history"].get("page_size", 1000))
+            history_max_buckets = int(config["history"].get("max_buckets", 10000))
+            history_max_chunks = int(config["history"].get("max_chunks", 120))
+            if (history_chunk_seconds <= 0 or history_page_size < 1 or history_max_buckets < 1 or
+                    history_max_chunks < 1):
+                raise ValueError("history chunk_seconds, page_size, max_buckets and max_chunks "
+                                 "must be positive")
+            writes_use_actuator = bool(config["writes"].get("use_actuator", False))
+            schedule_duration = float(config["writes"].get("schedule_duration", 300))
+            schedule_priority = str(config["writes"].get("schedule_priority", 'LOW'))
+            if schedule_duration <= 0 or schedule_priority not in ('HIGH', 'LOW', 'LOW_PREEMPT'):
+                raise ValueError("writes schedule_duration must be positive and schedule_priority "
+                                 "one of HIGH, LOW or LOW_PREEMPT")
+            compress_min_size = int(config["responses"].get("compress_min_size", 1024))
+            compress_level = int(config["responses"].get("compress_level", 6))
+            encoded_cache_entries = int(config["responses"].get("cache_entries", 64))
+            if compress_min_size < 0 or not 1 <= compress_level <= 9 or encoded_cache_entries < 0:
+                raise ValueError("Invalid responses compress_min_size, compress_level or cache_entries")
+            platform_concurrency = int(config["platform_calls"].get("concurrency", 8))
+            platform_timeout = float(config["platform_calls"].get("timeout", 10))
+            if platform_concurrency < 1 or platform_timeout <= 0:
+                raise ValueError("platform_calls concurrency and timeout must be positive")
+            # Schedules are renewed once less than platform_timeout is left of them
+            if schedule_duration <= platform_timeout:
+                raise ValueError("writes schedule_duration must be longer than platform_calls "
+                                 "timeout")
+            scrape_concurrency = int(config["platform_calls"].get("scrape_concurrency", 16))
+            if scrape_concurrency < 1:
+                raise ValueError("platform_calls scrape_concurrency must be positive")
+            call_timeout = float(config["platform_calls"].get("call_timeout", 10))
+            call_deadlines = {str(method): float(seconds) for method, seconds
+                              in dict(config["platform_calls"].get("deadlines") or {}).items()}
+            hedge_after = config["platform_calls"].get("hedge_after")
+            if hedge_after is not None and hedge_after != 'p95':
+                hedge_after = float(hedge_after)
+                if hedge_after <= 0:
+                    raise ValueError("platform_calls hedge_after must be positive")
+            if call_timeout <= 0 or any(seconds <= 0 for seconds in call_deadlines.values()):
+                raise ValueError("platform_calls call_timeout and deadlines must be positive")
+            last_values_platform = config["last_values"].get("platform") or self.core.instance_name
+            last_values_max_age = float(config["last_values"].get("max_age", 60))
+            # Only the token store can still fail, so it is switched to before anything else
+            self._auth.configure(**config["tokens"])
+        except (ValueError, TypeError) as e:
             _log.error("ERROR PROCESSING CONFIGURATION: {}".format(e))
             return
 
+        self._metadata_cache.configure(**config["metadata_cache"])
+        self._credentials.configure(**config["credentials"])
+        self._metrics.configure(**config["metrics"])
+        self._push.configure(**config["push"])
+        self._single_flight.configure(**config["single_flight"])
+        self._admission.configure(**config["admission"])
+        self._writes.configure(**writes)
+        self._health.configure(**config["circuit_breaker"])
         self.setting1 = setting1
         self.setting2 = setting2
+        self.platform_concurrency = platform_concurrency
+        self.platform_timeout = platform_timeout
+        self.scrape_concurrency = scrape_concurrency
+        self.call_timeout = call_timeout
+        self.call_deadlines = call_deadlines
+        self.hedge_after = hedge_after
+        if last_values_platform != self.last_values_platform:
+            self._last_values.remove_platform(self.last_values_platform)
+        self.last_values_platform = last_values_platform
+        self.last_values_max_age = last_values_max_age
+        self.compress_min_size = compress_min_size
+        self.compress_level = compress_level
+        self._encoded_responses.max_entries = encoded_cache_entries
+        if writes_use_actuator != self.writes_use_actuator:
+            self._schedules.clear()
+        self.writes_use_actuator = writes_use_actuator
+        self.schedule_duration = schedule_duration
+        self.schedule_priority = schedule_priority
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_max_age = snapshot_max_age
+        self.calls_max = calls_max
+        self.calls_concurrency = calls_concurrency
+        self.calls_min_timeout = calls_min_timeout
+        self.publish_batch_size = publish_batch_size
+        self.publish_max_in_flight = publish_max_in_flight
+        self.publish_max_errors = publish_max_errors
+        self.publish_denied_prefixes = tuple(publish_denied_prefixes)
+        self.publish_allowed_prefixes = (tuple(publish_allowed_prefixes)
+                                         if publish_allowed_prefixes is not None else None)
+        self.history_chunk_seconds = history_chunk_seconds
+        self.history_page_size = history_page_size
+        self.history_max_buckets = history_max_buckets
+        self.history_max_chunks = history_max_chunks
 
         self._create_subscriptions(self.setting2)
 
@@ -171,10 +611,59 @@ class Uiapiagent(Agent):
                                   prefix=topic,
                                   callback=self._handle_publish)
 
+        # Driver scrapes, to keep the last value store current
+        self.vip.pubsub.subscribe(peer='pubsub',
+                                  prefix='devices/',
+                                  callback=self._handle_device_publish)
+
     def _handle_publish(self, peer, sender, bus, topic, headers,
                                 message):
         pass
 
+    def _handle_device_publish(self, peer, sender, bus, topic, headers, message):
+        """Record point values from `devices/<device>/all` publishes."""
+        if not topic.endswith('/all'):
+            return
+        device_name = topic[len('devices/'):-len('/all')]
+        try:
+            values = message[0] if isinstance(message, list) else message
+            self._record_values(self.last_values_platform, device_name, values)
+        except (TypeError, ValueError, IndexError, AttributeError) as e:
+            _log.debug(f"Ignoring malformed publish on {topic}: {e}")
+
+    def _record_values(self, platform, device_name, values):
+        """Store the latest values of a device and push those that changed to subscribers."""
+        changes = self._last_values.update(platform, device_name, values)
+        if changes:
+            self._push.publish(platform, device_name, changes)
+
+    def _send_push(self, path, message):
+        self.vip.web.send(path, message)
+
+    def _unregister_push(self, path):
+        self.vip.web.unregister_websocket(path)
+
+    def _push_opened(self, fromip, endpoint):
+        client = self._push.get_client(endpoint)
+        if client is None or client.connected:
+            return False
+        _log.debug(f"Push client {client.id} connected from {fromip}")
+        client.connected = True
+        return True
+
+    def _push_closed(self, endpoint):
+        self._push.remove_client(endpoint)
+
+    def _push_received(self, endpoint, message):
+        """Replace a client's patterns with those sent as `{"patterns": [...]}`."""
+        client = self._push.get_client(endpoint)
+        try:
+            patterns = json.loads(message)['patterns']
+            if client is not None and _valid_patterns(patterns):
+                client.set_patterns(patterns)
+        except (ValueError, TypeError, KeyError):
+            _log.debug(f"Ignoring malformed message from push client at {endpoint}")
+
     @Core.receiver("onstart")
     def onstart(self, sender, **kwargs):
         """
@@ -186,14 +675,44 @@ class Uiapiagent(Agent):
         Usually not needed if using the configuration store.
         """
 
+        started = time.time()
+        phases = []
+
+        # Serve from the last snapshot until platforms have been queried again
+        if self.snapshot_path:
+            self.load_snapshot()
+        phases.append(('snapshot', time.time()))
+
         self.vip.web.register_endpoint(r'/helloworld', lambda env,data: "Hello World!") #Test Endpoint
 
+        # Keep cached platform metadata in step with platforms (dis)connecting
+        self.vip.peerlist.onadd.connect(self._on_peer_change)
+        self.vip.peerlist.ondrop.connect(self._on_peer_change)
+
         # NOTE: See _agent_route and _endpoint decorators for how the functions are collected.
-        for route_regex, method_name in _agent_routes:
-            self.vip.rpc.call(MASTER_WEB, 'register_agent_route', route_regex, method_name).get(timeout=10)
-        for endpoint_path, method_name in _agent_endpoints:
-            _log.debug((endpoint_path, method_name))
-            self.vip.web.register_endpoint(endpoint_path, getattr(self, method_name))
+        # Registrations are all sent before waiting for any of them.
+        registrations = [(route_regex, self.vip.rpc.call(MASTER_WEB, 'register_agent_route',
+                                                         route_regex, method_name))
+                         for route_regex, method_name in _agent_routes]
+        endpoints = [gevent.spawn(self.vip.web.register_endpoint, endpoint_path,
+                                  getattr(self, method_name), "raw")
+                     for endpoint_path, method_name in _agent_endpoints]
+        for route_regex, result in registrations:
+            result.get(timeout=10)
+        phases.append((f'{len(registrations)} routes', time.time()))
+        gevent.joinall(endpoints, timeout=10, raise_error=True)
+        phases.append((f'{len(endpoints)} endpoints', time.time()))
+
+        # Refresh platform metadata in the background, and keep saving it
+        gevent.spawn(self._warm_up)
+        self._snapshot_loop = gevent.spawn(self._save_snapshots)
+
+        previous = started
+        timings = []
+        for phase, finished in phases:
+            timings.append(f"{phase} {finished - previous:.3f}s")
+            previous = finished
+        _log.info(f"Started in {previous - started:.3f}s: {', '.join(timings)}")
 
         #Example publish to pubsub
         #self.vip.pubsub.publish('pubsub', "some/random/topic", message="HI!")
@@ -201,30 +720,91 @@ class Uiapiagent(Agent):
         #Exmaple RPC call
         #self.vip.rpc.call("some_agent", "some_method", arg1, arg2)
 
+    def load_snapshot(self):
+        """Restore platform metadata and device lists from `snapshot_path`, if saved recently."""
+        contents = load_snapshot(self.snapshot_path, self.snapshot_max_age)
+        if contents is None:
+            return
+        try:
+            restored = self._metadata_cache.restore(
+                [[key, self._devices.build(value) if key[0] == 'devices' else value]
+                 for key, value in contents['metadata']])
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            _log.warning(f"Ignoring malformed snapshot '{self.snapshot_path}': {e}")
+            return
+        _log.info(f"Restored {restored} metadata entries from {self.snapshot_path}")
+
+    def save_snapshot(self):
+        """Save platform metadata and device lists to `snapshot_path`."""
+        if not self.snapshot_path:
+            return
+        try:
+            metadata = [[key, value.to_dict() if isinstance(value, PlatformDevices) else value]
+                        for key, value in self._metadata_cache.snapshot()]
+            save_snapshot(self.snapshot_path, {'metadata': metadata})
+        except (OSError, TypeError, ValueError) as e:
+            _log.warning(f"Cannot save snapshot to '{self.snapshot_path}': {e}")
+
+    def _save_snapshots(self):
+        while True:
+            gevent.sleep(self.snapshot_interval)
+            self.save_snapshot()
+
+    def _warm_up(self):
+        """Query every platform, so that restored or missing metadata is brought up to date."""
+        started = time.time()
+        try:
+            hierarchy, unavailable = self.devices_hierarchy()
+        except Exception as e:
+            _log.warning(f"Warming up platform metadata failed: {e}")
+            return
+        _log.info(f"Queried {len(hierarchy)} platforms on startup in {time.time() - started:.3f}s"
+                  + (f", unavailable: {sorted(unavailable)}" if unavailable else ""))
+
     @endpoint(r'/devices/hierarchy')
     def endpoint_devices_hierarchy(self, env, data):
         """List devices on all platforms with point and status info.
 
+        Devices are listed under `platforms`. Platforms which timed out or failed are listed
+        under `unavailable` in `meta`, which is only present if there were any.
+
+        Query parameters:
+        - `limit`: Return at most this many devices, ordered by platform then device. If there
+            are more, `next_cursor` in `meta` holds the value of `cursor` for the next page.
+        - `cursor`: Continue from a previous page.
+        - `fields`: Comma separated device fields to include, e.g. `fields=health` leaves out
+            the point lists.
+        - `stream`: If true, encode the response device by device instead of building it first.
+
         Returns: JSON dict of devices nested by platform:
         ```
         {
-        "volttron1": {
-            "devices/fake-campus/fake-building/fake-device": {
-                "points": [
-                    "Heartbeat",
-                    "temperature",
-                    "PowerState",
-                    "ValveState",
-                    "EKG_Sin",
-                    "EKG_Cos"
-                ],
-                "health": {
-                    "status": "GOOD",
-                    "context": "Last received data on: 2020-04-02T01:39:10.025580+00:00",
-                    "last_updated": "2020-04-02T01:39:10.025729+00:00"
-                },
-                "last_publish_utc": "2020-04-02T01:39:10.025580+00:00"
+        "platforms": {
+            "volttron1": {
+                "devices/fake-campus/fake-building/fake-device": {
+                    "points": [
+                        "Heartbeat",
+                        "temperature",
+                        "PowerState",
+                        "ValveState",
+                        "EKG_Sin",
+                        "EKG_Cos"
+                    ],
+                    "health": {
+                        "status": "GOOD",
+                        "context": "Last received data on: 2020-04-02T01:39:10.025580+00:00",
+                        "last_updated": "2020-04-02T01:39:10.025729+00:00"
+                    },
+                    "last_publish_utc": "2020-04-02T01:39:10.025580+00:00"
+                }
             }
+        },
+        "meta": {
+            "unavailable": {
+                "volttron2": "timeout"
+            },
+            "next_cursor": "<cursor>"
+        }
         }
         ```
         """
@@ -235,13 +815,42 @@ class Uiapiagent(Agent):
         if not self.check_authorization(env, data):
             return format_response(401)
 
+        try:
+            page = parse_page_params(query_params(env))
+        except ValueError as e:
+            return format_response(400, str(e))
+
         # Call and format core function
-        return self.devices_hierarchy()
+        hierarchy, unavailable = self.devices_hierarchy()
+        etag = self._hierarchy_etag(env, hierarchy, unavailable)
+        if etag_matches(env, etag):
+            return format_response(304, headers=cache_headers(etag))
+        cached = self._cached_response(env, etag)
+        if cached is not None:
+            return cached
+
+        if not any(page.values()):
+            # Encode device by device from the compact records, rather than building it all
+            members = ((platform, devices.items()) for platform, devices in hierarchy.items())
+            response = self._device_listing_response('/devices/hierarchy', 'platforms', members,
+                                                     unavailable, None, True)
+            return self._cacheable_response(env, '/devices/hierarchy', response, etag)
+
+        entries, next_cursor = take_page(iter_devices(hierarchy, page['cursor']), page['limit'])
+        members = (
+            (platform, ((device, hierarchy[platform].render(record, page['fields']))
+                        for _, device, record in group))
+            for platform, group in itertools.groupby(entries, key=lambda entry: entry[0]))
+        response = self._device_listing_response('/devices/hierarchy', 'platforms', members,
+                                                 unavailable, next_cursor, page['stream'])
+        return self._cacheable_response(env, '/devices/hierarchy', response, etag)
 
     @endpoint(r'/platforms')
     def endpoint_platfoms_list(self, env, data):
         """List all platform names under the 'platforms' key.
 
+        Platforms which timed out or failed are also listed under `unavailable` in `meta`.
+
         TODO: Link to further endpoints."""
 
         # Auth and CORS handling
@@ -250,19 +859,70 @@ class Uiapiagent(Agent):
         if not self.check_authorization(env, data):
             return format_response(401)
 
-        return {platform:None for platform in self.devices_hierarchy().keys()}
+        hierarchy, unavailable = self.devices_hierarchy()
+        etag = self._hierarchy_etag(env, hierarchy, unavailable)
+        if etag_matches(env, etag):
+            return format_response(304, headers=cache_headers(etag))
+        cached = self._cached_response(env, etag)
+        if cached is not None:
+            return cached
+
+        platforms = {platform:None for platform in list(hierarchy) + list(unavailable)}
+        response = {'platforms': platforms,
+                    'meta': {'unavailable': unavailable} if unavailable else {}}
+        return self._cacheable_response(env, '/platforms', response, etag)
+
+    @endpoint(r'/platforms/health')
+    def endpoint_platforms_health(self, env, data):
+        """Breaker state and recent call latency of each platform.
+
+        Returns: JSON dict by platform, with latencies in seconds over recent successful calls:
+        ```
+        {
+            "volttron1": {
+                "connected": true,
+                "state": "closed" | "open" | "half_open",
+                "failures": 0,
+                "last_error": null,
+                "retry_in": null,
+                "latency": {"p50": 0.021, "p95": 0.048, "samples": 100}
+            }
+        }
+        ```
+        """
+
+        # Auth and CORS handling
+        if env['REQUEST_METHOD'].upper() == 'OPTIONS':
+            return format_response('preflight')
+        if not self.check_authorization(env, data):
+            return format_response(401)
+
+        connected = [connection.split('.')[0] for connection in self.list_platform_connections()]
+        response = self._health.status(connected)
+        for platform, status in response.items():
+            status['connected'] = platform in connected
+        return response
 
     @endpoint(r'/devices')
     def endpoint_devices_list(self, env, data):
         """List devices on all platforms with point and status info.
 
+        Accepts the `limit`, `cursor` and `stream` query parameters of `/devices/hierarchy`.
+
+        Devices are listed under `devices`, keyed by topic. A topic found on more than one
+        platform is instead keyed by the link of each of its devices. `meta` holds
+        `unavailable` platforms and `next_cursor` as for `/devices/hierarchy`.
+
         Returns: JSON dict of device objects:
         ```
         {
-            "/devices/fake-campus/fake-building/fake-device": {
-                "platform": "volttron1",
-                "link": "/devices/volttron1/fake-campus/fake-building/fake-device"
-            }
+            "devices": {
+                "/devices/fake-campus/fake-building/fake-device": {
+                    "platform": "volttron1",
+                    "link": "/devices/volttron1/fake-campus/fake-building/fake-device"
+                }
+            },
+            "meta": {}
         }
         ```
         """
@@ -273,17 +933,108 @@ class Uiapiagent(Agent):
         if not self.check_authorization(env, data):
             return format_response(401)
 
-        # Call and format core function
-        response = {}
-        for platform, device in self.devices_list():
-            # TODO: Throw Error if device name collision (Must return a list of 3 items [status,
-            #       content, headers], see create_response in master_web_service.py)
-            response[device] = {
-                "platform": platform,
-                "link": '/devices/' + platform + device.replace(r'devices', '', 1)
-            }
+        try:
+            page = parse_page_params(query_params(env))
+        except ValueError as e:
+            return format_response(400, str(e))
+
+        hierarchy, unavailable = self.devices_hierarchy()
+        etag = self._hierarchy_etag(env, hierarchy, unavailable)
+        if etag_matches(env, etag):
+            return format_response(304, headers=cache_headers(etag))
+        cached = self._cached_response(env, etag)
+        if cached is not None:
+            return cached
+
+        if any(page.values()):
+            entries, next_cursor = take_page(iter_devices(hierarchy, page['cursor']),
+                                             page['limit'])
+            members = self._device_list_members(hierarchy, entries)
+            response = self._device_listing_response('/devices', 'devices', members, unavailable,
+                                                     next_cursor, page['stream'])
+            return self._cacheable_response(env, '/devices', response, etag)
+
+        # Call and format core function, encoding device by device
+        members = self._device_list_members(hierarchy, iter_devices(hierarchy))
+        response = self._device_listing_response('/devices', 'devices', members, unavailable,
+                                                 None, True)
+        return self._cacheable_response(env, '/devices', response, etag)
+
+    @staticmethod
+    def _device_list_members(hierarchy, entries):
+        """Yield the `/devices` (key, value) members of `entries` from `iter_devices`.
+
+        Devices are keyed by topic, except where the same topic is found on more than one
+        platform. Each of those is keyed by its link instead, so that no device is lost.
+        """
+        counts = Counter(device for plat_devices in hierarchy.values() for device in plat_devices)
+        for platform, device, _ in entries:
+            link = '/devices/' + platform + device.replace(r'devices', '', 1)
+            yield (link if counts[device] > 1 else device), {"platform": platform, "link": link}
 
-        return response
+    def _hierarchy_etag(self, env, hierarchy, unavailable):
+        """ETag for a response built from the device hierarchy, or None if it is not cached.
+
+        Derived from the cache generation of each platform's devices rather than their
+        contents, so a matching request is answered without building or encoding the body.
+        ETags from an earlier run of the agent never match.
+        """
+        generations = [(platform, self._metadata_cache.generation(('devices', platform)))
+                       for platform in hierarchy]
+        if any(generation is None for _, generation in generations):
+            return None
+        version = (self._etag_epoch, env['PATH_INFO'], env.get('QUERY_STRING', ''), generations,
+                   sorted(unavailable.items()))
+        return '"' + hashlib.sha1(repr(version).encode('utf-8')).hexdigest() + '"'
+
+    def _cached_response(self, env, etag):
+        """Return the already encoded response for `etag` in the client's encoding, if kept."""
+        if etag is None:
+            return None
+        return self._encoded_responses.get(etag, negotiate(env.get('HTTP_ACCEPT_ENCODING')))
+
+    def _encode_response(self, env, response):
+        """Compress and encode a `[status, body, headers]` response for a raw endpoint."""
+        encoding = negotiate(env.get('HTTP_ACCEPT_ENCODING'))
+        encoded = encode_response(response, encoding, self.compress_min_size, self.compress_level)
+        etag = dict(encoded[2]).get('ETag')
+        if etag is not None and encoded[0].startswith('200'):
+            self._encoded_responses.put(etag, encoding, encoded)
+        return encoded
+
+    def _cacheable_response(self, env, path, response, etag):
+        """Encode `response` with ETag and Cache-Control headers, or answer 304 if unchanged.
+
+        Without an `etag` from the caller one is made by hashing the encoded body.
+        """
+        if isinstance(response, dict):
+            with self._metrics.time_serialize(path):
+                response = format_response(200, response)
+        if etag is None:
+            etag = '"' + hashlib.sha1(response[1].encode('utf-8')).hexdigest() + '"'
+            if etag_matches(env, etag):
+                return format_response(304, headers=cache_headers(etag))
+        return [response[0], response[1], response[2] + cache_headers(etag)]
+
+    def _device_listing_response(self, path, key, members, unavailable, next_cursor, stream):
+        """Respond with a page of device listing `members` ((key, value) pairs, where values
+        may be further iterators of pairs) under `key`, encoding it member by member if `stream`
+        is set.
+
+        Unavailable platforms and the cursor of the next page go under `meta`, apart from the
+        listing, so that they cannot be mistaken for a platform or device of the same name.
+        """
+        meta = {}
+        if unavailable:
+            meta['unavailable'] = unavailable
+        if next_cursor:
+            meta['next_cursor'] = next_cursor
+        document = [(key, members), ('meta', meta)]
+
+        if stream:
+            with self._metrics.time_serialize(path):
+                return format_response(200, ''.join(iter_json_object(document)))
+        return build_json_object(document)
 
     @agent_route(r'/devices/.*')
     @RPC.export
@@ -294,6 +1045,19 @@ class Uiapiagent(Agent):
         - Device Index: A list of links to the available endpoints
         - All Points: A list of points on the device and their current value
             TODO: Format response to be more RESTful
+        - All Points of a Subtree: The same for every device under a topic prefix (e.g.
+            `/devices/<platform>/<campus>/<building>/all`), see `subtree_all`
+        - Point: Get or set the value of a single point
+        - Point History: Values of a point recorded by the historian, see `point_history`
+
+        `POST` writes go through the write pipeline and wait up to `wait` seconds (query
+        parameter, defaults to the platform timeout) for the write to be made. The response is
+        the write ticket, with `202 Accepted` if the write is still pending; see
+        `endpoint_write_ticket`.
+
+        `GET` reads of all points or a single point are served from the last values published
+        by the driver when these are at most `max_age` seconds old (query parameter, defaults
+        to the `last_values` configuration), and scrape the device otherwise.
         - Health: (Not Implemented)
         - Last Published: (Not Implemented)
 
@@ -309,30 +1073,640 @@ class Uiapiagent(Agent):
         path_components = env['PATH_INFO'].split('/')[1:]  # First slash creates empty element
         platform = path_components[1]
 
-        if path_components[-1] == 'all':
-            device_name = '/'.join(path_components[2:-1])
-            return self.device_scrape_all(platform, device_name)
-        # TODO Health and Last Publish Endpoint routing here
-
-        if path_components[-2] == 'pt':
-            if env['REQUEST_METHOD'] == 'GET':
-                device_name = '/'.join(path_components[2:-2])
-                point_name = path_components[-1]
-                # return self.get_point(platform, device_name, point_name)
-                value = self.get_point(platform, device_name, point_name)
-                return {'value': value,
-                        'type': value.__class__.__name__}
-            if env['REQUEST_METHOD'] == 'POST':
-                device_name = '/'.join(path_components[2:-2])
-                point_name = path_components[-1]
-                value = data['value']
-                value = self.set_point(platform, device_name, point_name, value)
-                return {'value': value,
-                        'type': value.__class__.__name__}
+        try:
+            max_age = float(query_params(env).get('max_age', self.last_values_max_age))
+        except ValueError:
+            return format_response(400, "max_age must be a number of seconds")
 
+        try:
+            admission = self._admission.admit(request_token(env), [platform])
+        except AdmissionRejected as e:
+            return self._rejected_response(e)
+
+        with admission:
+            # /devices/<platform>/<device>/pt/<point>/history
+            if (path_components[-1] == 'history' and len(path_components) >= 6 and
+                    path_components[-3] == 'pt'):
+                device_name = '/'.join(path_components[2:-3])
+                return self._point_history_response(env, platform, device_name, path_components[-2])
+
+            if path_components[-1] == 'all':
+                device_name = '/'.join(path_components[2:-1])
+                devices = self.devices_under(platform, device_name)
+                if devices:
+                    stream = query_params(env).get('stream', '').lower() in ('1', 'true', 'yes')
+                    return self._subtree_response(platform, devices, max_age, stream)
+                return self.device_all(platform, device_name, max_age)
+            # TODO Health and Last Publish Endpoint routing here
+
+            if path_components[-2] == 'pt':
+                if env['REQUEST_METHOD'] == 'GET':
+                    device_name = '/'.join(path_components[2:-2])
+                    point_name = path_components[-1]
+                    # return self.get_point(platform, device_name, point_name)
+                    value = self.get_recent_point(platform, device_name, point_name, max_age)
+                    return {'value': value,
+                            'type': value.__class__.__name__}
+                if env['REQUEST_METHOD'] == 'POST':
+                    device_name = '/'.join(path_components[2:-2])
+                    point_name = path_components[-1]
+                    if not isinstance(data, dict) or 'value' not in data:
+                        return format_response(400, "Expected a value to set")
+                    try:
+                        wait = float(query_params(env).get('wait', self.platform_timeout))
+                    except ValueError:
+                        return format_response(400, "wait must be a number of seconds")
+                    ticket = self._writes.submit(platform, device_name, point_name, data['value'])
+                    return self._write_ticket_response(ticket, wait)
+
+            else:
+                device_name = '/'.join(path_components[2:])
+                return self.device_index(platform, device_name)
+
+    def _point_history_response(self, env, platform, device_name, point_name):
+        """Parse the query of a point history request and answer it.
+
+        Query parameters:
+        - `start`, `end`: The time range, as Unix seconds or ISO 8601. Defaults to the last day.
+        - `bucket`: If given, aggregate values over buckets of this duration, e.g. `300` or `5m`.
+        - `agg`: Comma separated aggregates to compute per bucket, some of `min,max,avg,last`
+            (default all).
+        """
+        params = query_params(env)
+        try:
+            end = parse_time(params['end']) if 'end' in params else time.time()
+            start = parse_time(params['start']) if 'start' in params else end - 86400
+            bucket = parse_duration(params['bucket']) if 'bucket' in params else None
+            aggregates = tuple(a for a in params.get('agg', ','.join(AGGREGATES)).split(',') if a)
+        except ValueError as e:
+            return format_response(400, str(e))
+        if start >= end:
+            return format_response(400, "start must be before end")
+        if set(aggregates) - set(AGGREGATES) or not aggregates:
+            return format_response(400, f"agg must be some of {','.join(AGGREGATES)}")
+        # Every chunk is at least one historian query, whether or not values are aggregated
+        if (end - start) / self.history_chunk_seconds > self.history_max_chunks:
+            return format_response(400, f"Ranges are limited to "
+                                        f"{int(self.history_max_chunks * self.history_chunk_seconds)} "
+                                        f"seconds")
+        if bucket is not None and (end - start) / bucket > self.history_max_buckets:
+            return format_response(400, f"Ranges are limited to {self.history_max_buckets} buckets")
+        return self.point_history(platform, device_name, point_name, start, end, bucket, aggregates)
+
+    def point_history(self, platform, device_name, point_name, start, end, bucket=None,
+                      aggregates=AGGREGATES):
+        """Query the historian of `platform` for the values of a point between `start` and `end`.
+
+        The range is split into chunks fetched concurrently, each through the VCP agent in pages.
+        Values are returned as parallel arrays, raw or aggregated over buckets of `bucket`
+        seconds starting at `start`, with times in Unix seconds:
+        ```
+        {"timestamps": [...], "values": [...]}
+        {"timestamps": [...], "count": [...], "min": [...], "max": [...], "avg": [...], "last": [...]}
+        ```
+        Only buckets with values are listed, and values which are not numbers are left out. Ranges
+        which could not be fetched are listed as `[start, end]` pairs under `missing`.
+        """
+        topic = f"{device_name}/{point_name}"
+
+        def fetch(time_range):
+            rows = []
+            try:
+                with gevent.Timeout(self.platform_timeout):
+                    while True:
+                        result = self.call_platform_agent(
+                            platform, PLATFORM_HISTORIAN, 'query',
+                            [topic, format_time(time_range[0]), format_time(time_range[1]),
+                             None, None, len(rows), self.history_page_size, 'FIRST_TO_LAST'])
+                        page = result.get('values', []) if isinstance(result, dict) else []
+                        rows.extend(page)
+                        if len(page) < self.history_page_size:
+                            return to_columns(rows)
+            except (gevent.Timeout, Exception) as e:
+                _log.warning(f"History of {topic} on {platform} from {time_range[0]} to "
+                             f"{time_range[1]} unavailable: {e}")
+                return None
+
+        ranges = chunk_ranges(start, end, self.history_chunk_seconds)
+        chunks = gevent.pool.Pool(self.platform_concurrency).map(self._metrics.bind(fetch), ranges)
+        timestamps = [t for chunk in chunks if chunk is not None for t in chunk[0]]
+        values = [v for chunk in chunks if chunk is not None for v in chunk[1]]
+
+        if bucket is None:
+            response = {'timestamps': timestamps, 'values': values}
         else:
-            device_name = '/'.join(path_components[2:])
-            return self.device_index(platform, device_name)
+            response = downsample(timestamps, values, start, bucket, aggregates)
+        missing = [list(time_range) for time_range, chunk in zip(ranges, chunks) if chunk is None]
+        if missing:
+            response['missing'] = missing
+        return response
+
+    @endpoint(r'/devices/search')
+    def endpoint_devices_search(self, env, data):
+        """Find devices across platforms by topic and point name.
+
+        Query parameters (all optional, combined with AND):
+        - `prefix`: Device topics starting with this, e.g. `campus/building1/`.
+        - `glob`: Device topics matching this glob, e.g. `campus/*/ahu?`.
+        - `point`: Devices having this point, or a point matching it as a glob, e.g. `*temp*`.
+        - `platform`: Devices on this platform.
+        - `limit`, `cursor`: Pages of results, as for `/devices/hierarchy`.
+
+        Platforms which timed out or failed are listed under `unavailable` in `meta`; their
+        devices are searched as last known.
+
+        Returns: JSON dict of matching devices ordered by platform then topic, with the points
+        matching `point` (all points if not given):
+        ```
+        {
+            "results": [
+                {"platform": "volttron1", "device": "campus/building1/ahu1",
+                 "points": ["ZoneTemperature"]}
+            ],
+            "meta": {"next_cursor": "<cursor>"}
+        }
+        ```
+        """
+
+        # Auth and CORS handling
+        if env['REQUEST_METHOD'].upper() == 'OPTIONS':
+            return format_response('preflight')
+        if not self.check_authorization(env, data):
+            return format_response(401)
+
+        params = query_params(env)
+        try:
+            page = parse_page_params(params)
+        except ValueError as e:
+            return format_response(400, str(e))
+
+        _hierarchy, unavailable = self.devices_hierarchy()
+        point = params.get('point')
+        matches = self._device_index.search(prefix=params.get('prefix'), glob=params.get('glob'),
+                                            point=point, platform=params.get('platform'))
+        if page['cursor'] is not None:
+            matches = matches[bisect.bisect_right(matches, page['cursor']):]
+        entries, next_cursor = take_page(((platform, device, None) for platform, device in matches),
+                                         page['limit'])
+
+        results = []
+        for platform, device, _record in entries:
+            points = (self._device_index.matching_points(platform, device, point) if point
+                      else sorted(self._device_index.points(platform, device)))
+            results.append({'platform': platform, 'device': device, 'points': points})
+        meta = {}
+        if next_cursor:
+            meta['next_cursor'] = next_cursor
+        if unavailable:
+            meta['unavailable'] = unavailable
+        return {'results': results, 'meta': meta}
+
+    @endpoint(r'/devices/batch')
+    def endpoint_points_batch(self, env, data):
+        """Get or set many points, on any devices and platforms, in one request.
+
+        Request Body: A list of points, those with a `value` are set, the others read. Accepts
+        the same `max_age` query parameter as the single point endpoint.
+        ```
+        {
+            "points": [
+                {"platform": "volttron1", "device": "fake-campus/fake-building/fake-device",
+                 "point": "temperature"},
+                {"platform": "volttron1", "device": "fake-campus/fake-building/fake-device",
+                 "point": "ValveState", "value": 1}
+            ]
+        }
+        ```
+
+        Returns: JSON dict with a result per requested point, in request order:
+        ```
+        {
+            "results": [
+                {"platform": "volttron1", "device": "fake-campus/fake-building/fake-device",
+                 "point": "temperature", "value": 72.5, "type": "float"},
+                {"platform": "volttron1", "device": "fake-campus/fake-building/fake-device",
+                 "point": "ValveState", "error": "<message>"}
+            ]
+        }
+        ```
+        """
+
+        # Auth and CORS handling
+        if env['REQUEST_METHOD'].upper() == 'OPTIONS':
+            return format_response('preflight')
+        if not self.check_authorization(env, data):
+            return format_response(401)
+
+        if env['REQUEST_METHOD'].upper() != 'POST':
+            return format_response(400, "Batch requests must be POSTed")
+        try:
+            max_age = float(query_params(env).get('max_age', self.last_values_max_age))
+        except ValueError:
+            return format_response(400, "max_age must be a number of seconds")
+
+        items = data.get('points') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not all(
+                isinstance(item, dict) and
+                all(isinstance(item.get(k), str) for k in ('platform', 'device', 'point'))
+                for item in items):
+            return format_response(400, "Expected a list of points with platform, device and point "
+                                        "names")
+
+        try:
+            admission = self._admission.admit(request_token(env), [item['platform'] for item in items])
+        except AdmissionRejected as e:
+            return self._rejected_response(e)
+        with admission:
+            return {'results': self.batch_points(items, max_age)}
+
+    @endpoint(r'/calls')
+    def endpoint_calls(self, env, data):
+        """Make many RPC calls and publishes, on any platforms, in one request.
+
+        RPC calls are made to an agent on a platform through its VCP agent. Publishes go onto
+        this platform's message bus, as the VCP agent offers no way to publish on another.
+
+        Calls run concurrently (at most `concurrency` at once, see the `calls` configuration),
+        each within its `timeout` (seconds, at least `min_timeout`, defaulting to the deadlines of
+        the platform calls).
+        With `ordered` they run one after another instead, and with `stop_on_error` as well the
+        calls following a failed one are skipped.
+
+        Request Body:
+        ```
+        {
+            "calls": [
+                {"platform": "volttron1", "agent": "platform.driver", "method": "get_point",
+                 "params": ["fake-campus/fake-building/fake-device", "temperature"], "timeout": 5},
+                {"platform": "volttron1", "publish": "some/topic", "message": {"a": 1},
+                 "headers": {}}
+            ],
+            "ordered": false,
+            "stop_on_error": false
+        }
+        ```
+
+        Returns: JSON dict with a result per call, in request order, holding either `result` or
+        `error`, and the `seconds` the call took:
+        ```
+        {
+            "results": [
+                {"result": 72.5, "seconds": 0.021},
+                {"error": "<message>", "seconds": 0.0}
+            ]
+        }
+        ```
+        """
+
+        # Auth and CORS handling
+        if env['REQUEST_METHOD'].upper() == 'OPTIONS':
+            return format_response('preflight')
+        if not self.check_authorization(env, data):
+            return format_response(401)
+
+        if env['REQUEST_METHOD'].upper() != 'POST':
+            return format_response(400, "Calls must be POSTed")
+        calls = data.get('calls') if isinstance(data, dict) else None
+        if not isinstance(calls, list) or not all(
+                isinstance(call, dict) and isinstance(call.get('platform'), str) and
+                (isinstance(call.get('publish'), str) or
+                 isinstance(call.get('agent'), str) and isinstance(call.get('method'), str) and
+                 isinstance(call.get('params', []), list))
+                for call in calls):
+            return format_response(400, "Expected a list of calls, each with a platform and "
+                                        "either an agent, method and list of params or a topic "
+                                        "to publish")
+        if len(calls) > self.calls_max:
+            return format_response(400, f"At most {self.calls_max} calls may be made at once")
+        try:
+            for call in calls:
+                if call.get('timeout') is not None and float(call['timeout']) <= 0:
+                    raise ValueError
+        except (TypeError, ValueError):
+            return format_response(400, "timeout must be a positive number of seconds")
+
+        try:
+            admission = self._admission.admit(request_token(env), [call['platform'] for call in calls])
+        except AdmissionRejected as e:
+            return self._rejected_response(e)
+        with admission:
+            return {'results': self.make_calls(calls, ordered=bool(data.get('ordered')),
+                                               stop_on_error=bool(data.get('stop_on_error')))}
+
+    def make_calls(self, calls, ordered=False, stop_on_error=False):
+        """Make RPC calls and publishes as described for `/calls`, returning a result for each."""
+
+        def make(call):
+            start = time.time()
+            # A timeout is the deadline of the RPC call itself, rather than a timeout around it,
+            # so a short one cannot cut short calls shared with other requests
+            timeout = (max(self.calls_min_timeout, float(call['timeout']))
+                       if call.get('timeout') is not None else None)
+            try:
+                if 'publish' in call:
+                    with gevent.Timeout(timeout or self.call_timeout):
+                        self._publish(call['platform'], call['publish'], call.get('headers') or {},
+                                      call.get('message'))
+                    result = {'result': None}
+                else:
+                    params = call.get('params')
+                    result = {'result': self.call_platform_agent(
+                        call['platform'], call['agent'], call['method'],
+                        params if params is not None else [], timeout)}
+            except gevent.Timeout:
+                result = {'error': 'timeout'}
+            except Exception as e:
+                result = {'error': str(e) or e.__class__.__name__}
+            result['seconds'] = round(time.time() - start, 6)
+            return result
+
+        if not ordered:
+            return gevent.pool.Pool(self.calls_concurrency).map(self._metrics.bind(make), calls)
+
+        results = []
+        for call in calls:
+            if stop_on_error and results and 'error' in results[-1]:
+                results.append({'error': 'skipped', 'seconds': 0.0})
+            else:
+                results.append(make(call))
+        return results
+
+    def _publish(self, platform, topic, headers, message):
+        """Publish on the message bus of `platform`, which must be this one."""
+        if platform != self.last_values_platform:
+            raise ValueError(f"Can only publish on this platform ('{self.last_values_platform}')")
+        error = self._topic_error(topic)
+        if error:
+            raise ValueError(error)
+        with self._metrics.time_rpc(platform, 'publish'):
+            self.vip.pubsub.publish('pubsub', topic, headers=headers, message=message).get()
+
+    def _topic_error(self, topic):
+        """Return why `topic` may not be published on through the API, or None if it may."""
+        if not isinstance(topic, str) or not topic:
+            return "Expected a topic"
+        if topic.startswith(self.publish_denied_prefixes):
+            return f"Cannot publish on reserved topic '{topic}'"
+        if (self.publish_allowed_prefixes is not None and
+                not topic.startswith(self.publish_allowed_prefixes)):
+            return f"Publishing on topic '{topic}' is not allowed"
+        return None
+
+    @endpoint(r'/bus/publish')
+    def endpoint_bulk_publish(self, env, data):
+        """Publish many messages onto this platform's message bus from a newline delimited JSON body.
+
+        Each line of the body is one message to publish. `platform` may be left out, and must be
+        this platform if given, as the VCP agent offers no way to publish on another:
+        ```
+        {"topic": "record/site1/meter1", "message": {"kw": 12.5}, "headers": {}}
+        {"platform": "volttron1", "topic": "record/site1/meter2", "message": {"kw": 3.1}}
+        ```
+        Blank lines are skipped. Messages to the same topic are published in the order given.
+        Topics reserved for the platform, such as `devices/...`, and any not allowed by the
+        `publish` configuration are rejected.
+
+        Returns: JSON dict of the number of messages published and rejected, with the line number
+        and reason of each rejected one (up to `max_errors`, see the `publish` configuration):
+        ```
+        {
+            "accepted": 9998,
+            "rejected": 2,
+            "errors": [{"line": 17, "error": "<message>"}, {"line": 503, "error": "timeout"}]
+        }
+        ```
+        """
+
+        # Auth and CORS handling
+        if env['REQUEST_METHOD'].upper() == 'OPTIONS':
+            return format_response('preflight')
+        if not self.check_authorization(env, data):
+            return format_response(401)
+
+        if env['REQUEST_METHOD'].upper() != 'POST':
+            return format_response(400, "Messages must be POSTed")
+        try:
+            admission = self._admission.admit(request_token(env), [self.last_values_platform])
+        except AdmissionRejected as e:
+            return self._rejected_response(e)
+        with admission:
+            return self.bulk_publish(body_lines(data))
+
+    def bulk_publish(self, lines):
+        """Publish numbered NDJSON lines (or decoded records) as described for `/bus/publish`.
+
+        Lines are read `publish_batch_size` at a time and their messages published grouped by
+        platform and topic. Publishes are not waited on one by one: up to
+        `publish_max_in_flight` are left in flight, and reading stops while that many are.
+        """
+        summary = {'accepted': 0, 'rejected': 0, 'errors': []}
+        in_flight = deque()  # (line number, AsyncResult) of publishes not yet acknowledged
+
+        def reject(number, error):
+            summary['rejected'] += 1
+            if len(summary['errors']) < self.publish_max_errors:
+                summary['errors'].append({'line': number, 'error': error})
+
+        def settle(number, result):
+            try:
+                result.get(timeout=self.call_timeout)
+                summary['accepted'] += 1
+            except gevent.Timeout:
+                reject(number, 'timeout')
+            except Exception as e:
+                reject(number, str(e) or e.__class__.__name__)
+
+        def batches():
+            batch = []
+            for number, line in lines:
+                batch.append((number, line))
+                if len(batch) >= self.publish_batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        for batch in batches():
+            groups = {}  # (platform, topic) -> [(line number, record)], in line order
+            for number, line in batch:
+                if isinstance(line, (str, bytes)):
+                    if not line.strip():
+                        continue
+                    try:
+                        line = loads(line)
+                    except ValueError:
+                        reject(number, "Invalid JSON")
+                        continue
+                if not (isinstance(line, dict) and isinstance(line.get('topic'), str) and line['topic']
+                        and isinstance(line.get('headers') or {}, dict)):
+                    reject(number, "Expected a JSON object with a topic, a message and optional headers")
+                    continue
+                key = (line.get('platform', self.last_values_platform), line['topic'])
+                groups.setdefault(key, []).append((number, line))
+
+            for (platform, topic), records in groups.items():
+                error = (f"Can only publish on this platform ('{self.last_values_platform}')"
+                         if platform != self.last_values_platform else self._topic_error(topic))
+                if error:
+                    for number, _ in records:
+                        reject(number, error)
+                    continue
+                for number, record in records:
+                    while len(in_flight) >= self.publish_max_in_flight:
+                        settle(*in_flight.popleft())
+                    try:
+                        in_flight.append((number, self.vip.pubsub.publish(
+                            'pubsub', topic, headers=record.get('headers') or {},
+                            message=record.get('message'))))
+                    except Exception as e:
+                        reject(number, str(e) or e.__class__.__name__)
+        while in_flight:
+            settle(*in_flight.popleft())
+
+        summary['errors'].sort(key=lambda error: error['line'])
+        self._metrics.inc('uiapi_published_total', summary['accepted'], status='accepted')
+        self._metrics.inc('uiapi_published_total', summary['rejected'], status='rejected')
+        return summary
+
+    def _rejected_response(self, rejection):
+        """A `429` response for a request over an admission limit, saying when to retry."""
+        self._metrics.inc('uiapi_admission_rejected_total', scope=rejection.scope)
+        return format_response(429, str(rejection),
+                               [('Retry-After', str(max(1, math.ceil(rejection.retry_after))))])
+
+    @endpoint(r'/admission')
+    def endpoint_admission(self, env, data):
+        """Current use of the admission limits, of the caller's token and of each platform.
+
+        Returns: JSON dict of the requests in flight and the rate limit tokens available, for the
+        caller's token, every platform and (by a short hash) every token seen recently:
+        ```
+        {
+            "token": {"in_flight": 1, "concurrency": 8, "available": 17.5, "burst": 40},
+            "platforms": {"volttron1": {"in_flight": 3, "concurrency": 32, "available": 180.2, "burst": 200}},
+            "tokens": {"<hash>": {"in_flight": 1, "concurrency": 8, "available": 17.5, "burst": 40}}
+        }
+        ```
+        Limits which are disabled are `null`.
+        """
+
+        # Auth and CORS handling
+        if env['REQUEST_METHOD'].upper() == 'OPTIONS':
+            return format_response('preflight')
+        if not self.check_authorization(env, data):
+            return format_response(401)
+
+        return self._admission.utilization(request_token(env))
+
+    @endpoint(r'/devices/writes')
+    def endpoint_write_ticket(self, env, data):
+        """Get the state of a point write made through `POST /devices/<device_path>/pt/<point>`.
+
+        Query parameters:
+        - `ticket`: The id of the write ticket.
+        - `wait`: Seconds to wait for a pending write to be made (at most the platform timeout,
+            default 0).
+
+        Returns: The write ticket, with `202 Accepted` if the write is still pending:
+        ```
+        {
+            "ticket": "<id>",
+            "platform": "volttron1",
+            "device": "fake-campus/fake-building/fake-device",
+            "point": "ValveState",
+            "value": 1,
+            "type": "int",
+            "status": "pending" | "done" | "failed" | "superseded",
+            "error": "<message, if failed>",
+            "superseded_by": "<id of the later write to the point, if superseded>"
+        }
+        ```
+        """
+
+        # Auth and CORS handling
+        if env['REQUEST_METHOD'].upper() == 'OPTIONS':
+            return format_response('preflight')
+        if not self.check_authorization(env, data):
+            return format_response(401)
+
+        params = query_params(env)
+        ticket = self._writes.get(params.get('ticket'))
+        if ticket is None:
+            return format_response(400, "Unknown or expired write ticket")
+        try:
+            wait = float(params.get('wait', 0))
+        except ValueError:
+            return format_response(400, "wait must be a number of seconds")
+        return self._write_ticket_response(ticket, wait)
+
+    def _write_ticket_response(self, ticket, wait):
+        """Wait up to `wait` seconds (capped at the platform timeout) for a write ticket to resolve."""
+        if wait > 0:
+            ticket.wait(min(wait, self.platform_timeout))
+        if ticket.status == 'pending':
+            return format_response(202, ticket.to_dict())
+        return ticket.to_dict()
+
+    @endpoint(r'/devices/push')
+    def endpoint_devices_push(self, env, data):
+        """Subscribe to changes of point values, to be pushed over a WebSocket.
+
+        Patterns are globs over `<platform>/<device>/<point>`, e.g. `volttron1/campus/building1/*`
+        for every point in a building or `*/temperature` for every temperature point. Once
+        connected, the WebSocket receives the changed values at most every `window` seconds:
+        `{"timestamp": <unix time>, "values": {"<platform>/<device>/<point>": <value>}}`.
+        Sending `{"patterns": [...]}` over the WebSocket replaces the patterns.
+
+        Request Body:
+        ```
+        {
+            "patterns": ["volttron1/campus/building1/*"]
+        }
+        ```
+
+        Returns: The id of the subscription and the path of its WebSocket:
+        ```
+        {
+            "id": "<id>",
+            "websocket": "/devices/push/<id>"
+        }
+        ```
+        """
+
+        # Auth and CORS handling
+        if env['REQUEST_METHOD'].upper() == 'OPTIONS':
+            return format_response('preflight')
+        if not self.check_authorization(env, data):
+            return format_response(401)
+
+        if env['REQUEST_METHOD'].upper() != 'POST':
+            return format_response(400, "Push subscriptions must be POSTed")
+        patterns = data.get('patterns') if isinstance(data, dict) else None
+        if not _valid_patterns(patterns):
+            return format_response(400, "Expected a list of patterns")
+
+        try:
+            client = self._push.add_client(patterns)
+        except ValueError as e:
+            return format_response(400, str(e))
+        self.vip.web.register_websocket(client.path, self._push_opened, self._push_closed,
+                                        self._push_received)
+        return {'id': client.id, 'websocket': client.path}
+
+    @endpoint(r'/metrics')
+    def endpoint_metrics(self, env, data):
+        """Request, RPC and encoding latencies and error counts in the Prometheus text format."""
+
+        # Auth and CORS handling
+        if env['REQUEST_METHOD'].upper() == 'OPTIONS':
+            return format_response('preflight')
+        if not self.check_authorization(env, data):
+            return format_response(401)
+
+        return ['200 OK',
+                self._metrics.render(),
+                [('Content-Type', 'text/plain; version=0.0.4'),
+                 ('Access-Control-Allow-Origin', '*')]]
 
     @endpoint(r'/auth')
     def handle_auth(self, env, data):
@@ -353,28 +1727,137 @@ class Uiapiagent(Agent):
         return "Method not supported."
 
     def get_point(self, platform, device_name, point_name):
-        platform_connection_agent_id = '.'.join([platform, VOLTTRON_CENTRAL_PLATFORM])
+        return self.call_platform_agent(platform, PLATFORM_DRIVER, 'get_point',
+                                        [device_name, point_name])
 
-        result = self.vip.rpc.call(
-            platform_connection_agent_id,
-            'route_to_agent_method',
-            'endpoint_device',  # JSONRPC request ID
-            'platform.uuid.{}.get_point'.format(self.get_agent_uuid(platform, PLATFORM_DRIVER)),
-            [device_name, point_name]
-        ).get()
-        return result
+    def get_recent_point(self, platform, device_name, point_name, max_age):
+        """Return the last published value of a point if recent enough, else read it live."""
+        last_value = self._last_values.get_point(platform, device_name, point_name, max_age)
+        if last_value is not None:
+            return last_value[0]
+        return self.get_point(platform, device_name, point_name)
 
-    def set_point(self, platform, device_name, point_name, value):
-        platform_connection_agent_id = '.'.join([platform, VOLTTRON_CENTRAL_PLATFORM])
+    def _write_device(self, platform, device_name, point_values):
+        """Set several points of a device in one call, returning errors by point.
 
-        result = self.vip.rpc.call(
-            platform_connection_agent_id,
-            'route_to_agent_method',
-            'endpoint_device',  # JSONRPC request ID
-            'platform.uuid.{}.set_point'.format(self.get_agent_uuid(platform, PLATFORM_DRIVER)),
-            [device_name, point_name, value]
-        ).get()
-        return result
+        Called by the write pipeline. Goes through the actuator if `writes_use_actuator`,
+        acquiring a schedule for the device first unless a current one is held.
+        """
+        topics_values = [[f"{device_name}/{point}", value] for point, value in point_values]
+        try:
+            with gevent.Timeout(self.platform_timeout):
+                if self.writes_use_actuator:
+                    self._hold_schedule(platform, device_name)
+                    errors = self.call_platform_agent(platform, PLATFORM_ACTUATOR,
+                                                      'set_multiple_points',
+                                                      [self.core.identity, topics_values])
+                else:
+                    errors = self.call_platform_agent(platform, PLATFORM_DRIVER,
+                                                      'set_multiple_points',
+                                                      [device_name, [[point, value] for point, value
+                                                                     in point_values]])
+        except gevent.Timeout:
+            errors = {point: 'timeout' for point, _value in point_values}
+        finally:
+            # Values read before the write are no longer current
+            self._single_flight.forget(platform, device_name)
+            self._last_values.remove_device(platform, device_name)
+
+        errors = errors or {}
+        if errors:
+            # A failure may be due to the schedule having been preempted, so get a new one next time
+            self._schedules.pop((platform, device_name), None)
+        # The driver and actuator key errors by full topic, accept bare point names as well
+        point_errors = {}
+        for point, _value in point_values:
+            error = errors.get(f"{device_name}/{point}", errors.get(point))
+            if error:
+                point_errors[point] = error
+        return point_errors
+
+    def _hold_schedule(self, platform, device_name):
+        """Make sure an actuator schedule is held for the device, requesting one if needed.
+
+        A held schedule is reused until it has less than `platform_timeout` seconds left, then
+        one following on from it, for another `schedule_duration` seconds, is requested.
+        """
+        now = utils.get_aware_utc_now()
+        held_until = self._schedules.get((platform, device_name))
+        if held_until is not None and held_until - now > timedelta(seconds=self.platform_timeout):
+            return
+        start = max(now, held_until) if held_until is not None else now
+        end = start + timedelta(seconds=self.schedule_duration)
+        task_id = f"{self.core.identity}/{device_name}/{int(now.timestamp() * 1000)}"
+        result = self.call_platform_agent(platform, PLATFORM_ACTUATOR, 'request_new_schedule',
+                                          [self.core.identity, task_id, self.schedule_priority,
+                                           [[device_name, utils.format_timestamp(start),
+                                             utils.format_timestamp(end)]]])
+        if not isinstance(result, dict) or result.get('result') != 'SUCCESS':
+            info = result.get('info') if isinstance(result, dict) else result
+            raise ValueError(f"Actuator refused a schedule for {device_name} on {platform}: {info}")
+        self._schedules[(platform, device_name)] = end
+
+    def batch_points(self, items, max_age):
+        """Read and write many points, grouped into one driver call per device.
+
+        Reads use recent enough published values where available and `get_multiple_points`
+        otherwise; writes use `set_multiple_points`. Device groups are run concurrently, each
+        within `platform_timeout` seconds.
+
+        Returns a result dict per item, in order, holding either `value` and `type` or `error`.
+        """
+        results = [dict(platform=item['platform'], device=item['device'], point=item['point'])
+                   for item in items]
+        groups = {}  # (platform, device, is write) -> [item index]
+        for index, item in enumerate(items):
+            if 'value' not in item:
+                last_value = self._last_values.get_point(item['platform'], item['device'],
+                                                         item['point'], max_age)
+                if last_value is not None:
+                    results[index].update(value=last_value[0],
+                                          type=last_value[0].__class__.__name__)
+                    continue
+            key = (item['platform'], item['device'], 'value' in item)
+            groups.setdefault(key, []).append(index)
+
+        def run_group(group):
+            (platform, device_name, is_write), indices = group
+            try:
+                with gevent.Timeout(self.platform_timeout):
+                    if is_write:
+                        points = [[items[i]['point'], items[i]['value']] for i in indices]
+                        try:
+                            errors = self.call_platform_agent(platform, PLATFORM_DRIVER,
+                                                              'set_multiple_points',
+                                                              [device_name, points]) or {}
+                        finally:
+                            # Published values from before the write are no longer current
+                            self._last_values.remove_device(platform, device_name)
+                        values = {point: value for point, value in points}
+                    else:
+                        points = [items[i]['point'] for i in indices]
+                        values, errors = self.call_platform_agent(platform, PLATFORM_DRIVER,
+                                                                  'get_multiple_points',
+                                                                  [device_name, points])
+            except gevent.Timeout:
+                errors, values = {items[i]['point']: 'timeout' for i in indices}, {}
+            except Exception as e:
+                errors, values = {items[i]['point']: str(e) for i in indices}, {}
+
+            for i in indices:
+                point = items[i]['point']
+                # The driver keys results by full topic, accept bare point names as well
+                topic = f"{device_name}/{point}"
+                error = errors.get(topic, errors.get(point))
+                if error is None and (topic in values or point in values):
+                    value = values.get(topic, values.get(point))
+                    results[i].update(value=value, type=value.__class__.__name__)
+                else:
+                    results[i]['error'] = error or "No value returned"
+
+        gevent.pool.Pool(self.platform_concurrency).map(self._metrics.bind(run_group),
+                                                        groups.items())
+        return results
 
     def device_index(self, platform, device_name):
         # TODO: Handle incorrect device
@@ -386,78 +1869,324 @@ class Uiapiagent(Agent):
         response = {"links": {endpt: f"/devices/{platform}/{device_name}/{endpt}" for endpt in device_endpoints}}
         return response
 
+    def device_all(self, platform, device_name, max_age):
+        """Return the last published values of a device if recent enough, else scrape it."""
+        last_values = self._last_values.get_device(platform, device_name, max_age)
+        if last_values is not None:
+            return last_values[0]
+        return self.device_scrape_all(platform, device_name)
+
+    def devices_under(self, platform, prefix):
+        """List the devices of `platform` whose topic is under `prefix`, per the device index.
+
+        Returns an empty list if `prefix` is itself a device, or not known to be a subtree.
+        """
+        if self._device_index.points(platform, prefix) is not None:
+            return []
+        # Make sure the index is current (the hierarchy is normally cached)
+        _hierarchy, _unavailable = self.devices_hierarchy()
+        if self._device_index.points(platform, prefix) is not None:
+            return []
+        return [device for _platform, device
+                in self._device_index.search(prefix=prefix.rstrip('/') + '/', platform=platform)]
+
+    def subtree_all(self, platform, devices, max_age):
+        """Read all points of many devices of a platform concurrently.
+
+        Devices are read as by `device_all`, at most `scrape_concurrency` at a time and each
+        within `platform_timeout` seconds. Yields `(device, result)` pairs as each completes,
+        where the result holds either `values` or `error`, and the `seconds` the device took.
+        """
+        # Look the driver up once rather than in each greenlet
+        self.get_agent_uuid(platform, PLATFORM_DRIVER)
+
+        def read(device_name):
+            start = time.time()
+            try:
+                with gevent.Timeout(self.platform_timeout):
+                    result = {'values': self.device_all(platform, device_name, max_age)}
+            except gevent.Timeout:
+                result = {'error': 'timeout'}
+            except Exception as e:
+                result = {'error': str(e) or e.__class__.__name__}
+            result['seconds'] = round(time.time() - start, 6)
+            return device_name, result
+
+        return gevent.pool.Pool(self.scrape_concurrency).imap_unordered(self._metrics.bind(read),
+                                                                         devices)
+
+    def _subtree_response(self, platform, devices, max_age, stream):
+        """Respond with all points of `devices`, nested under `devices` by topic.
+
+        If `stream` is set the body is encoded device by device as each completes, rather than
+        once all have; otherwise devices are listed in topic order.
+        """
+        results = self.subtree_all(platform, devices, max_age)
+        if stream:
+            return format_response(200, ''.join(iter_json_object([('devices', results)])))
+        return {'devices': dict(sorted(results))}
+
     def device_scrape_all(self, platform, device_name):
+        result = self.call_platform_agent(platform, PLATFORM_DRIVER, 'scrape_all', [device_name])
+        # Only this platform's values are kept, as only its driver publishes keep them current;
+        # remote platforms are scraped on every read
+        if isinstance(result, dict) and platform == self.last_values_platform:
+            self._record_values(platform, device_name, result)
+        return result
+
+    def call_platform_agent(self, platform, agent_id, method, params, deadline=None):
+        """Call `method` of agent `agent_id` on `platform` through the platform's VCP agent.
+
+        If the call fails because the platform no longer knows a cached agent UUID, the UUID is
+        looked up again and, if the agent restarted under a new one, the call is retried once.
+        `deadline` overrides the seconds the call is given.
+        """
+        agent_uuid = self.get_agent_uuid(platform, agent_id)
+        try:
+            return self._route_to_agent_method(platform, agent_uuid, method, params, deadline)
+        except RemoteError as e:
+            if not names_unknown_agent(e, agent_uuid):
+                raise
+            self._metadata_cache.invalidate(('agent_uuid', platform, agent_id))
+            fresh_uuid = self.get_agent_uuid(platform, agent_id)
+            if fresh_uuid == agent_uuid:
+                raise
+            _log.info(f"Agent '{agent_id}' on '{platform}' restarted as {fresh_uuid}")
+            return self._route_to_agent_method(platform, fresh_uuid, method, params, deadline)
+
+    def _route_to_agent_method(self, platform, agent_uuid, method, params, deadline=None):
         platform_connection_agent_id = '.'.join([platform, VOLTTRON_CENTRAL_PLATFORM])
 
-        result = self.vip.rpc.call(
-            platform_connection_agent_id,
-            'route_to_agent_method',
-            'endpoint_device',  # JSONRPC request ID
-            'platform.uuid.{}.scrape_all'.format(self.get_agent_uuid(platform, PLATFORM_DRIVER)),
-            [device_name]
-        ).get()
+        def call():
+            return self._call_rpc(platform, method, platform_connection_agent_id,
+                                  'route_to_agent_method',
+                                  'endpoint_device',  # JSONRPC request ID
+                                  'platform.uuid.{}.{}'.format(agent_uuid, method),
+                                  params, deadline=deadline)
+
+        device_name = params[0] if params else None
+        if method not in COALESCED_DRIVER_METHODS:
+            try:
+                return call()
+            finally:
+                # Reads of the device coalesced or published before this call may no longer be
+                # current, even if it failed part way
+                self._single_flight.forget(platform, device_name)
+                if isinstance(device_name, str):
+                    self._last_values.remove_device(platform, device_name)
+        # Only calls given the same deadline share one
+        return self._coalesced(platform, method, (platform, device_name, method, agent_uuid,
+                                                  repr(params), deadline),
+                               lambda: self._hedged(platform, call))
+
+    def _call_platform_connection(self, platform_connection_id, method, *args):
+        """Call an RPC method of a platform's VCP agent."""
+        platform = platform_connection_id.split('.')[0]
+
+        def call():
+            return self._call_rpc(platform, method, platform_connection_id, method, *args)
+
+        if method not in COALESCED_PLATFORM_METHODS:
+            return call()
+        return self._coalesced(platform, method, (platform, None, method, repr(args)),
+                               lambda: self._hedged(platform, call))
+
+    def _call_rpc(self, platform, method, peer, rpc_method, *args, deadline=None):
+        """Make an RPC call to `platform` within the deadline of `method`, through its breaker.
+
+        Raises UnknownPlatform without calling if `peer` is not a connected platform, and
+        CircuitOpen while the platform's breaker is open. Errors raised by
+        the agent called are not held against the platform, as it did answer. A `deadline` given
+        by the caller replaces that of `method`, but is not held against the platform if shorter.
+        """
+        # Platform names come from clients, so are checked before a breaker is made for them
+        if peer not in self.list_platform_connections():
+            raise UnknownPlatform(platform)
+        self._health.before_call(platform)
+        start = time.time()
+        method_deadline = self.call_deadlines.get(method, self.call_timeout)
+        counted = deadline is None or deadline >= method_deadline
+        deadline = gevent.Timeout(method_deadline if deadline is None else deadline)
+        deadline.start()
+        try:
+            with self._metrics.time_rpc(platform, method):
+                result = self.vip.rpc.call(peer, rpc_method, *args).get()
+        except RemoteError:
+            self._health.record_success(platform, time.time() - start)
+            raise
+        except gevent.Timeout as e:
+            # Only this call's own deadline counts against the platform, not a caller's timeout
+            if e is deadline and counted:
+                self._health.record_failure(platform, 'timeout')
+            raise
+        except Exception as e:
+            self._health.record_failure(platform, e)
+            raise
+        finally:
+            deadline.close()
+        self._health.record_success(platform, time.time() - start)
         return result
 
-    def devices_list(self):
-        response = []
-        for platform, plat_devices in self.devices_hierarchy().items():
-            for devices in plat_devices.keys():
-                response.append((platform, devices))
+    def _hedged(self, platform, call):
+        """Run a read, repeating it if unanswered after `hedge_after`, and return the first answer.
 
-        _log.debug(f"devices_list is: {response}")
-        return response
+        The call still outstanding once one succeeds is abandoned. Fails only if all calls fail.
+        """
+        delay = (self._health.latency(platform, 0.95) if self.hedge_after == 'p95'
+                 else self.hedge_after)
+        if delay is None:
+            return call()
+
+        result = gevent.event.AsyncResult()
+        calls = []
+
+        def attempt():
+            try:
+                result.set(call())
+            except gevent.GreenletExit:
+                raise
+            except BaseException as e:
+                calls.remove(gevent.getcurrent())
+                if not calls:
+                    result.set_exception(e)
+
+        attempt = self._metrics.bind(attempt)
+        calls.append(gevent.spawn(attempt))
+        try:
+            result.wait(delay)
+            if not result.ready():
+                self._metrics.inc('uiapi_rpc_hedged_total', platform=platform)
+                calls.append(gevent.spawn(attempt))
+            return result.get()
+        finally:
+            gevent.killall(calls, block=False)
+
+    def _coalesced(self, platform, method, key, call):
+        # The call runs in a greenlet of its own, which is attributed to this request
+        result, shared = self._single_flight.do(key, self._metrics.bind(call))
+        if shared:
+            self._metrics.inc('uiapi_rpc_coalesced_total', platform=platform, method=method)
+        return result
 
     def devices_hierarchy(self):
-        """List device information by platform."""
+        """List device information by platform, as PlatformDevices.
+
+        Platforms are queried concurrently, at most `platform_concurrency` at a time, and each
+        is given `platform_timeout` seconds to answer.
+
+        Returns a tuple of the devices by platform name and a dict of the platforms that timed
+        out or failed, mapped to the reason.
+        """
+        platform_connections = self.list_platform_connections()
+        results = {}
+        unavailable = {}
+
+        def fetch_devices(platform_connection_id):
+            platform_name = platform_connection_id.split('.')[0]
+            try:
+                with gevent.Timeout(self.platform_timeout):
+                    results[platform_name] = self._metadata_cache.get(
+                        ('devices', platform_name),
+                        lambda: self._devices.build(self._call_platform_connection(
+                            platform_connection_id, 'get_devices')))
+            except gevent.Timeout:
+                _log.warning(f"Timed out listing devices on '{platform_name}'")
+                unavailable[platform_name] = 'timeout'
+            except Exception as e:
+                _log.warning(f"Failed listing devices on '{platform_name}': {e}")
+                unavailable[platform_name] = str(e)
+
+        gevent.pool.Pool(self.platform_concurrency).map(self._metrics.bind(fetch_devices),
+                                                        platform_connections)
+
+        # Keep platforms in peer list order regardless of which answered first
         response = {}
-        for platform_connection_id in self.list_platform_connections():
+        for platform_connection_id in platform_connections:
             platform_name = platform_connection_id.split('.')[0]
-            devices = self.vip.rpc.call(platform_connection_id, 'get_devices').get()
-            response[platform_name] = devices
+            if platform_name in results:
+                response[platform_name] = results[platform_name]
+        self._update_device_index(response, unavailable)
+        return response, unavailable
 
-        return response
+    def _update_device_index(self, hierarchy, unavailable):
+        """Re-index the platforms whose devices changed, and drop those no longer connected.
+
+        Platforms which are unavailable keep what was last indexed for them.
+        """
+        for platform, devices in hierarchy.items():
+            generation = self._metadata_cache.generation(('devices', platform))
+            if generation is None or generation != self._device_index.generation(platform):
+                self._device_index.update_platform(platform, devices.iter_points(), generation)
+                self._devices.purge(hierarchy.values())
+        for platform in self._device_index.platforms():
+            if platform not in hierarchy and platform not in unavailable:
+                self._device_index.remove_platform(platform)
 
     def list_platform_connections(self):
         """List VCConnection agents which represent each platform."""
-        platform_connection_agents = [x for x in self.vip.peerlist().get(timeout=5)
+        return self._metadata_cache.get(('peerlist',), self._load_platform_connections)
+
+    def _load_platform_connections(self):
+        with self._metrics.time_rpc('', 'peerlist'):
+            peers = self.vip.peerlist().get(timeout=5)
+        platform_connection_agents = [x for x in peers
                      if x.startswith('vcp-') or x.endswith('.platform.agent')]
+
+        # Forget everything cached for platforms which have since disconnected
+        previous = self._metadata_cache.peek(('peerlist',)) or []
+        for platform_connection_id in set(previous) - set(platform_connection_agents):
+            self._metadata_cache.invalidate_platform(platform_connection_id.split('.')[0])
+            self._health.forget(platform_connection_id.split('.')[0])
+
         return platform_connection_agents
 
+    def _on_peer_change(self, sender, peer, **kwargs):
+        """Drop cached metadata when a platform connection agent joins or leaves the bus."""
+        if isinstance(peer, bytes):
+            peer = peer.decode('utf-8')
+        if peer.startswith('vcp-') or peer.endswith('.platform.agent'):
+            self._metadata_cache.invalidate(('peerlist',))
+            self._metadata_cache.invalidate_platform(peer.split('.')[0])
+            # Give a platform which (re)joins a fresh start
+            self._health.forget(peer.split('.')[0])
+
     def get_agent_uuid(self, platform, agent_id):
+        return self._metadata_cache.get(('agent_uuid', platform, agent_id),
+                                        lambda: self._load_agent_uuid(platform, agent_id))
+
+    def _load_agent_uuid(self, platform, agent_id):
         platform_connection_agent = '.'.join([platform, "platform.agent"])
-        agents = self.vip.rpc.call(platform_connection_agent, "list_agents").get()
+        agents = self._call_platform_connection(platform_connection_agent, "list_agents")
         # Return first match for the master driver agent, raise error
         try:
             return next(agent for agent in agents if agent['identity'] == agent_id)['uuid']
         except StopIteration:
-            raise RuntimeError(f"No agent '{agent}' on platform '{platform}'")
+            raise RuntimeError(f"No agent '{agent_id}' on platform '{platform}'")
 
     def make_token(self, data, env):
         """Generate an API token if authorized"""
         if 'username' not in data or 'password' not in data:
             return "Username and password must be specified."
 
-        # TODO Return early since auth is not yet working
+        # TODO Credentials are not checked unless enabled, since auth is not yet working
+        if self._credentials.enabled:
+            # Check if user information is correct, at the configured URL only: the Host header
+            # is the client's to choose
+            start = time.time()
+            try:
+                result = self._credentials.verify(data['username'], data['password'],
+                                                  env['REMOTE_ADDR'])
+            except requests.RequestException as e:
+                _log.warning(f"Cannot verify credentials at {self._credentials.url}: {e}")
+                self._metrics.observe('uiapi_auth_seconds', time.time() - start, result='error')
+                return format_response(503, "Cannot verify credentials right now")
+            self._metrics.observe('uiapi_auth_seconds', time.time() - start, result=result)
+            if result not in (VALID, CACHED):
+                return "Invalid username/password specified."
+
         token = self._auth.generate_token(data['username'],
                                           data['password'])
         return { 'token' : token }
-        # TODO Remove to here
-
-        # Check if user information is correct
-        auth_url = "{url_scheme}://{HTTP_HOST}/authenticate".format(
-            url_scheme=env['wsgi.url_scheme'],
-            HTTP_HOST=env['HTTP_HOST'])
-        args = {'username': data['username'],
-                'password': data['password'],
-                'ip': env['REMOTE_ADDR']}
-        resp = requests.post(auth_url, json=args, verify=False)
-
-        if resp.ok and resp.text:
-            token = self._auth.generate_token(data['username'],
-                                              data['password'])
-            return { 'token' : token }
-        else:
-            return "Invalid username/password specified."
 
     def get_token(self, data, env):
         """Retrieve API token"""
@@ -482,13 +2211,8 @@ class Uiapiagent(Agent):
 
     def check_authorization(self, env, data):
         """Verify API token"""
-        try:
-            auth_type, token = env['HTTP_AUTHORIZATION'].split()
-            if auth_type.upper() == "BASIC":
-                return self._auth.validate_token(token)
-            return False
-        except (KeyError, IndexError,ValueError):
-            return False
+        token = request_token(env)
+        return token is not None and self._auth.validate_token(token)
 
     @Core.receiver("onstop")
     def onstop(self, sender, **kwargs):
@@ -496,6 +2220,10 @@ class Uiapiagent(Agent):
         This method is called when the Agent is about to shutdown, but before it disconnects from
         the message bus.
         """
+        if self._snapshot_loop is not None:
+            self._snapshot_loop.kill()
+        self.save_snapshot()
+        self._credentials.close()
         self.vip.web.unregister_all_routes()
 
 
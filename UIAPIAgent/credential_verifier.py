@@ -0,0 +1,117 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+import gevent
+import gevent.monkey
+import requests
+from requests.adapters import HTTPAdapter
+
+# Outcomes of a verification
+VALID = 'valid'
+CACHED = 'cached'
+INVALID = 'invalid'
+
+
+class CredentialVerifier(object):
+    """Checks logins against the platform's `/authenticate` endpoint at `url`.
+
+    The URL is only ever taken from configuration, never from a request, so that a client
+    cannot point the check at a server of its own.
+
+    Checks share a keep-alive session with at most `pool_size` connections, so a login does not
+    cost a new TLS handshake. They are run on gevent's thread pool unless sockets are already
+    cooperative, so a slow check does not hold up other requests.
+
+    Successful checks are remembered for `cache_ttl` seconds (0 disables), keyed by a salted hash
+    of the URL and credentials so that no password is kept. A password changed on the platform
+    is therefore still accepted here for up to `cache_ttl` seconds.
+    """
+
+    def __init__(self, enabled=False, url=None, cache_ttl=60, max_cached=1000, pool_size=10,
+                 timeout=5, verify_tls=True):
+        self.pool_size = None
+        self._session = None
+        self._cache = OrderedDict()  # credentials key -> expiry time, oldest first
+        self._salt = os.urandom(16).hex()
+        self.configure(enabled, url, cache_ttl, max_cached, pool_size, timeout, verify_tls)
+
+    def configure(self, enabled=False, url=None, cache_ttl=60, max_cached=1000, pool_size=10,
+                  timeout=5, verify_tls=True):
+        cache_ttl, max_cached = float(cache_ttl), int(max_cached)
+        pool_size, timeout = int(pool_size), float(timeout)
+        if cache_ttl < 0 or max_cached < 1 or pool_size < 1 or timeout <= 0:
+            raise ValueError("Credential cache_ttl must not be negative, max_cached, pool_size "
+                             "and timeout positive")
+        if enabled and not (isinstance(url, str) and url.startswith(('https://', 'http://'))):
+            raise ValueError("Credential checks need the http(s) url of the /authenticate "
+                             "endpoint")
+        self.enabled = bool(enabled)
+        self.url = url
+        self.cache_ttl = cache_ttl
+        self.max_cached = max_cached
+        self.timeout = timeout
+        self.verify_tls = verify_tls
+        if pool_size != self.pool_size and self._session is not None:
+            self._session.close()
+            self._session = None
+        self.pool_size = pool_size
+        self._cache.clear()
+
+    def verify(self, username, password, ip):
+        """Check credentials by POSTing them to `url`, returning VALID, CACHED or INVALID.
+
+        Raises requests.RequestException if the check could not be made.
+        """
+        url = self.url
+        key = self._key(url, username, password)
+        now = time.time()
+        expiry = self._cache.get(key)
+        if expiry is not None:
+            if expiry > now:
+                return CACHED
+            del self._cache[key]
+
+        args = {'username': username, 'password': password, 'ip': ip}
+        session = self._get_session()
+        if gevent.monkey.is_module_patched('socket'):
+            resp = self._post(session, url, args)
+        else:
+            resp = gevent.get_hub().threadpool.apply(self._post, (session, url, args))
+        if isinstance(resp, requests.RequestException):
+            raise resp
+        if not (resp.ok and resp.text):
+            return INVALID
+
+        if self.cache_ttl:
+            self._cache[key] = time.time() + self.cache_ttl
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return VALID
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _post(self, session, url, args):
+        # Errors are returned rather than raised, which the thread pool would log as a crash
+        try:
+            return session.post(url, json=args, verify=self.verify_tls, timeout=self.timeout)
+        except requests.RequestException as e:
+            return e
+
+    def _get_session(self):
+        if self._session is None:
+            # Block for a free connection rather than open more than pool_size
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
+
+    def _key(self, url, username, password):
+        credentials = '\0'.join([self._salt, url, username, password])
+        return hashlib.sha256(credentials.encode('utf-8')).hexdigest()
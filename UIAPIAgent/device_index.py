@@ -0,0 +1,171 @@
+import fnmatch
+import re
+
+# Characters which make a glob more than a literal
+_GLOB_CHARS = re.compile(r'[*?\[]')
+
+
+class _Node(object):
+    """A topic segment in the trie, with the platforms having a device ending at it."""
+
+    def __init__(self):
+        self.children = {}      # segment -> _Node
+        self.platforms = set()  # platforms with a device whose topic ends here
+
+
+class DeviceIndex(object):
+    """Device topics and their point names, indexed for searching.
+
+    Device topics (without the `devices/` prefix) are held in a trie by `/` separated segment,
+    shared across platforms, and point names in an inverted index to the devices having them.
+    Each platform is indexed from its devices' point names and re-indexed incrementally, only
+    touching devices which were added, removed or had their points change. Devices with the
+    same points share one set of them.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._devices = {}      # (platform, device) -> frozenset of point names
+        self._points = {}       # point name -> set of (platform, device)
+        self._generations = {}  # platform -> generation of the devices indexed
+        self._point_sets = {}   # frozenset of point names -> the shared frozenset
+        self._purge_at = 1024
+
+    def generation(self, platform):
+        """Return the generation last indexed for `platform`, or None if not indexed."""
+        return self._generations.get(platform)
+
+    def platforms(self):
+        return list(self._generations)
+
+    def update_platform(self, platform, devices, generation=None):
+        """Index a platform's devices, given as (device topic, point names) pairs, replacing
+        what was indexed for it before."""
+        if len(self._point_sets) >= self._purge_at:
+            self._point_sets = {points: points for points in self._devices.values()}
+            self._purge_at = max(1024, 2 * len(self._point_sets))
+        current = {}
+        for topic, points in devices:
+            device = topic[len('devices/'):] if topic.startswith('devices/') else topic
+            points = frozenset(points)
+            current[device] = self._point_sets.setdefault(points, points)
+
+        for key in [k for k in self._devices if k[0] == platform and k[1] not in current]:
+            self._remove(key)
+        for device, points in current.items():
+            if self._devices.get((platform, device)) != points:
+                self._remove((platform, device))
+                self._add((platform, device), points)
+        self._generations[platform] = generation
+
+    def remove_platform(self, platform):
+        for key in [k for k in self._devices if k[0] == platform]:
+            self._remove(key)
+        self._generations.pop(platform, None)
+
+    def points(self, platform, device):
+        return self._devices.get((platform, device))
+
+    def search(self, prefix=None, glob=None, point=None, platform=None):
+        """Return the sorted (platform, device) pairs matching all the filters given.
+
+        - `prefix`: Device topics starting with this. A prefix ending in `/` matches whole
+            segments only, so `campus/building1/` does not match `campus/building10/...`.
+        - `glob`: Device topics matching this glob, e.g. `campus/*/ahu?`.
+        - `point`: Devices having a point with this name, or with a name matching it as a glob.
+        - `platform`: Devices on this platform.
+        """
+        candidates = None
+        if glob:
+            # Narrow the glob down by its literal start before matching it
+            literal = _GLOB_CHARS.split(glob, 1)[0]
+            if prefix is None or literal.startswith(prefix):
+                prefix = literal
+            elif not prefix.startswith(literal):
+                return []
+        if prefix:
+            candidates = set(self._under_prefix(prefix))
+        if point:
+            with_point = self._with_point(point)
+            candidates = with_point if candidates is None else candidates & with_point
+        if candidates is None:
+            candidates = self._devices.keys()
+
+        regex = re.compile(fnmatch.translate(glob)) if glob else None
+        return sorted(key for key in candidates
+                      if (platform is None or key[0] == platform) and
+                      (regex is None or regex.match(key[1])))
+
+    def matching_points(self, platform, device, point):
+        """Return the points of a device named `point` or matching it as a glob."""
+        points = self._devices.get((platform, device), ())
+        if not _GLOB_CHARS.search(point):
+            return [point] if point in points else []
+        return sorted(fnmatch.filter(points, point))
+
+    def _with_point(self, point):
+        if not _GLOB_CHARS.search(point):
+            return set(self._points.get(point, ()))
+        devices = set()
+        for name in fnmatch.filter(self._points, point):
+            devices.update(self._points[name])
+        return devices
+
+    def _under_prefix(self, prefix):
+        """Yield (platform, device) for devices whose topic starts with `prefix`."""
+        segments = prefix.split('/')
+        # A trailing partial segment matches children starting with it
+        partial = segments.pop()
+        node = self._root
+        for segment in segments:
+            node = node.children.get(segment)
+            if node is None:
+                return
+        starts = [(segment, child) for segment, child in node.children.items()
+                  if segment.startswith(partial)]
+        path = '/'.join(segments)
+        for segment, child in starts:
+            yield from self._walk(child, f"{path}/{segment}" if path else segment)
+
+    def _walk(self, node, topic):
+        stack = [(node, topic)]
+        while stack:
+            node, topic = stack.pop()
+            for platform in node.platforms:
+                yield platform, topic
+            stack.extend((child, f"{topic}/{segment}") for segment, child in node.children.items())
+
+    def _add(self, key, points):
+        platform, device = key
+        node = self._root
+        for segment in device.split('/'):
+            node = node.children.setdefault(segment, _Node())
+        node.platforms.add(platform)
+        self._devices[key] = points
+        for point in points:
+            self._points.setdefault(point, set()).add(key)
+
+    def _remove(self, key):
+        points = self._devices.pop(key, None)
+        if points is None:
+            return
+        for point in points:
+            devices = self._points.get(point)
+            devices.discard(key)
+            if not devices:
+                del self._points[point]
+
+        platform, device = key
+        path = [self._root]
+        for segment in device.split('/'):
+            path.append(path[-1].children[segment])
+        path[-1].platforms.discard(platform)
+        # Prune the nodes left with no devices under them
+        for segment, node, parent in zip(reversed(device.split('/')), reversed(path[1:]),
+                                         reversed(path[:-1])):
+            if node.platforms or node.children:
+                break
+            del parent.children[segment]
+
+    def __len__(self):
+        return len(self._devices)
@@ -0,0 +1,242 @@
+import sys
+from array import array
+from datetime import datetime
+
+from .history import format_time
+from .paging import DEVICE_FIELDS
+
+# Health fields which are held compactly; any others are kept as given, as are other fields
+# of a device record than DEVICE_FIELDS
+HEALTH_FIELDS = ('status', 'context', 'last_updated')
+
+# Timestamp slots for a field the platform left out, or gave as null
+_ABSENT = float('-inf')
+_NULL = float('inf')
+
+# Stand for a field left out of a record, and for a record without a health dict
+_NOT_GIVEN = object()
+_NO_HEALTH = object()
+
+# Health context of a publishing device, which repeats its last publish time
+_RECEIVED = 'Last received data on: '
+_RECEIVED_AT_PUBLISH = object()
+
+
+class DeviceRecord(object):
+    """A device of a platform, held compactly.
+
+    The topic is held as interned `/` separated segments, and the point names as a tuple shared
+    by every device with the same points. Timestamps are held by the platform's PlatformDevices.
+    """
+    __slots__ = ('segments', 'points', 'status', 'context', 'extra', 'health_extra', 'slot')
+
+    @property
+    def topic(self):
+        return '/'.join(self.segments)
+
+    def _state(self):
+        return (self.segments, self.points, self.status, self.context, self.extra,
+                self.health_extra, self.slot)
+
+
+class PlatformDevices(object):
+    """A platform's `get_devices` result, held compactly and rendered back on demand.
+
+    Devices are kept in topic order, with their health and publish times in arrays of Unix
+    seconds. Times which would not format back exactly as given are kept as given instead.
+    """
+
+    def __init__(self, records, last_updated, last_publish, raw_times):
+        self._records = records          # [DeviceRecord] in topic order
+        self._by_segments = {record.segments: record for record in records}
+        self._last_updated = last_updated
+        self._last_publish = last_publish
+        self._raw_times = raw_times      # (slot, field) -> time as given
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return (record.topic for record in self._records)
+
+    def __contains__(self, topic):
+        return tuple(topic.split('/')) in self._by_segments
+
+    def __eq__(self, other):
+        if not isinstance(other, PlatformDevices):
+            return NotImplemented
+        return (len(self._records) == len(other._records) and
+                self._last_updated == other._last_updated and
+                self._last_publish == other._last_publish and
+                self._raw_times == other._raw_times and
+                all(mine._state() == theirs._state()
+                    for mine, theirs in zip(self._records, other._records)))
+
+    __hash__ = None
+
+    def get(self, topic, fields=None):
+        """Return the record of device `topic` as `get_devices` gave it, or None."""
+        record = self._by_segments.get(tuple(topic.split('/')))
+        return None if record is None else self.render(record, fields)
+
+    def records(self, after=None):
+        """Yield DeviceRecords in topic order, starting after topic `after` if given."""
+        start = 0
+        if after is not None:
+            # Records are in order of their joined topics, which tuples of segments do not follow
+            low, high = 0, len(self._records)
+            while low < high:
+                middle = (low + high) // 2
+                if self._records[middle].topic <= after:
+                    low = middle + 1
+                else:
+                    high = middle
+            start = low
+        for index in range(start, len(self._records)):
+            yield self._records[index]
+
+    def items(self, fields=None):
+        """Yield (topic, record) in topic order, with records rendered as by `render`."""
+        for record in self._records:
+            yield record.topic, self.render(record, fields)
+
+    def iter_points(self):
+        """Yield (topic, point names) of every device."""
+        for record in self._records:
+            yield record.topic, record.points or ()
+
+    def render(self, record, fields=None):
+        """Return a device's record as a dict, with only `fields` if given."""
+        rendered = {}
+        if record.points is not None and (fields is None or 'points' in fields):
+            rendered['points'] = list(record.points)
+        if record.status is not _NO_HEALTH and (fields is None or 'health' in fields):
+            health = {}
+            if record.status is not _NOT_GIVEN:
+                health['status'] = record.status
+            if record.context is _RECEIVED_AT_PUBLISH:
+                health['context'] = _RECEIVED + self._time(record.slot, 'last_publish_utc')
+            elif record.context is not _NOT_GIVEN:
+                health['context'] = record.context
+            last_updated = self._time(record.slot, 'last_updated')
+            if last_updated is not _NOT_GIVEN:
+                health['last_updated'] = last_updated
+            if record.health_extra:
+                health.update(record.health_extra)
+            rendered['health'] = health
+        if fields is None or 'last_publish_utc' in fields:
+            last_publish = self._time(record.slot, 'last_publish_utc')
+            if last_publish is not _NOT_GIVEN:
+                rendered['last_publish_utc'] = last_publish
+        if record.extra:
+            rendered.update((field, value) for field, value in record.extra.items()
+                            if fields is None or field in fields)
+        return rendered
+
+    def to_dict(self):
+        """Return the devices as `get_devices` gave them."""
+        return dict(self.items())
+
+    def _time(self, slot, field):
+        seconds = (self._last_updated if field == 'last_updated' else self._last_publish)[slot]
+        if seconds == _ABSENT:
+            return self._raw_times.get((slot, field), _NOT_GIVEN)
+        if seconds == _NULL:
+            return None
+        return format_time(seconds)
+
+
+class DeviceRegistry(object):
+    """Builds PlatformDevices, sharing point name tables between devices and platforms."""
+
+    def __init__(self):
+        self._point_tables = {}  # tuple of point names -> the shared tuple
+        self._purge_at = 1024
+
+    def build(self, devices):
+        """Return a PlatformDevices holding a `get_devices` result."""
+        if isinstance(devices, PlatformDevices):
+            return devices
+        records = []
+        last_updated, last_publish = array('d'), array('d')
+        raw_times = {}
+
+        for slot, (topic, given) in enumerate(sorted(devices.items())):
+            record = DeviceRecord()
+            record.segments = tuple(sys.intern(segment) for segment in topic.split('/'))
+            record.slot = slot
+            given = given if isinstance(given, dict) else {}
+            extra = {field: value for field, value in given.items() if field not in DEVICE_FIELDS}
+
+            points = given.get('points')
+            record.points = self._point_table(points) if isinstance(points, list) else None
+            if record.points is None and 'points' in given:
+                extra['points'] = points
+
+            publish = given.get('last_publish_utc', _NOT_GIVEN)
+            last_publish.append(self._seconds(publish, slot, 'last_publish_utc', raw_times))
+
+            health = given.get('health', _NOT_GIVEN)
+            record.health_extra = None
+            if isinstance(health, dict):
+                status = health.get('status', _NOT_GIVEN)
+                record.status = sys.intern(status) if isinstance(status, str) else status
+                context = health.get('context', _NOT_GIVEN)
+                record.context = (_RECEIVED_AT_PUBLISH
+                                  if isinstance(publish, str) and context == _RECEIVED + publish
+                                  else context)
+                last_updated.append(self._seconds(health.get('last_updated', _NOT_GIVEN), slot,
+                                                  'last_updated', raw_times))
+                record.health_extra = {field: value for field, value in health.items()
+                                       if field not in HEALTH_FIELDS} or None
+            else:
+                record.status = record.context = _NO_HEALTH
+                last_updated.append(_ABSENT)
+                if health is not _NOT_GIVEN:
+                    extra['health'] = health
+            record.extra = extra or None
+            records.append(record)
+
+        return PlatformDevices(records, last_updated, last_publish, raw_times)
+
+    def purge(self, platforms):
+        """Drop point tables no longer used by any of `platforms` (PlatformDevices)."""
+        if len(self._point_tables) < self._purge_at:
+            return
+        used = {record.points for devices in platforms for record in devices._records
+                if record.points is not None}
+        self._point_tables = {points: points for points in used}
+        self._purge_at = max(1024, 2 * len(self._point_tables))
+
+    def __len__(self):
+        return len(self._point_tables)
+
+    def _point_table(self, points):
+        """Return the shared tuple of `points`, or None if they are not all names."""
+        table = self._point_tables.get(tuple(points))
+        if table is None:
+            if not all(isinstance(point, str) for point in points):
+                return None
+            table = tuple(sys.intern(point) for point in points)
+            self._point_tables[table] = table
+        return table
+
+    @staticmethod
+    def _seconds(value, slot, field, raw_times):
+        """Return a time as Unix seconds, or keep it in `raw_times` if it does not round trip."""
+        if value is _NOT_GIVEN:
+            return _ABSENT
+        if value is None:
+            return _NULL
+        # Only UTC times in the form format_time gives, to the microsecond or second, come back
+        # out exactly as given
+        if (isinstance(value, str) and value.endswith('+00:00') and value[10:11] == 'T' and
+                (len(value) == 32 and value[19:20] == '.' and value[20:26] != '000000' or
+                 len(value) == 25)):
+            try:
+                return datetime.fromisoformat(value).timestamp()
+            except ValueError:
+                pass
+        raw_times[(slot, field)] = value
+        return _ABSENT
+
@@ -0,0 +1,110 @@
+import base64
+import gzip
+import json
+import zlib
+from collections import OrderedDict
+
+# Use the fastest JSON encoder available, falling back to the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# Encodings we can produce, in order of preference
+ENCODINGS = ('gzip', 'deflate')
+
+
+def dumps(obj):
+    """Encode `obj` as a JSON string."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        except TypeError:
+            pass
+    elif ujson is not None:
+        try:
+            return ujson.dumps(obj, ensure_ascii=False)
+        except (TypeError, OverflowError):
+            pass
+    return json.dumps(obj)
+
+
+def loads(text):
+    """Decode a JSON string or bytes. Raises ValueError if it is not valid JSON."""
+    if orjson is not None:
+        return orjson.loads(text)
+    if ujson is not None:
+        return ujson.loads(text)
+    return json.loads(text)
+
+
+def negotiate(accept_encoding):
+    """Pick a content encoding from an Accept-Encoding header, or None for identity."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        accepted[name.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding, level=6):
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=level)
+    if encoding == 'deflate':
+        return zlib.compress(body, level)
+    return body
+
+
+class EncodedResponse(list):
+    """A finished `[status, base64 body, headers]` response, ready for a raw web endpoint."""
+
+
+def encode_response(response, encoding, min_size=1024, level=6):
+    """Turn a `[status, body, headers]` response into an EncodedResponse.
+
+    The body is compressed with `encoding` if it is at least `min_size` bytes.
+    """
+    status, body, headers = response
+    body = body.encode('utf-8') if isinstance(body, str) else body
+    headers = list(headers)
+    if encoding and len(body) >= min_size:
+        body = compress(body, encoding, level)
+        headers += [('Content-Encoding', encoding), ('Vary', 'Accept-Encoding')]
+    return EncodedResponse([status, base64.b64encode(body).decode('ascii'), headers])
+
+
+class EncodedResponseCache(object):
+    """Least recently used cache of encoded responses by ETag and content encoding."""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._responses = OrderedDict()
+
+    def get(self, etag, encoding):
+        response = self._responses.get((etag, encoding))
+        if response is not None:
+            self._responses.move_to_end((etag, encoding))
+        return response
+
+    def put(self, etag, encoding, response):
+        if self.max_entries < 1:
+            return
+        self._responses[(etag, encoding)] = response
+        self._responses.move_to_end((etag, encoding))
+        while len(self._responses) > self.max_entries:
+            self._responses.popitem(last=False)
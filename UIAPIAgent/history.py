@@ -0,0 +1,127 @@
+import re
+from datetime import datetime, timezone
+
+# Use numpy to aggregate if available, falling back to plain Python
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Aggregates which may be computed per bucket
+AGGREGATES = ('min', 'max', 'avg', 'last')
+
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_time(value):
+    """Parse a time given as Unix seconds or an ISO 8601 string (UTC if no offset) to Unix seconds."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid time '{value}', expected Unix seconds or ISO 8601")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def parse_duration(value):
+    """Parse a duration such as `300`, `30s`, `5m`, `1h` or `1d` to seconds."""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d*)?)\s*([smhd]?)\s*', value)
+    if match is None:
+        raise ValueError(f"Invalid duration '{value}', expected seconds or e.g. 5m, 1h, 1d")
+    seconds = float(match.group(1)) * _DURATION_UNITS.get(match.group(2) or 's')
+    if seconds <= 0:
+        raise ValueError("Durations must be positive")
+    return seconds
+
+
+def format_time(seconds):
+    """Format Unix seconds as an ISO 8601 UTC string, as the historian expects."""
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+def chunk_ranges(start, end, chunk_seconds):
+    """Split [start, end) into consecutive ranges of at most `chunk_seconds`."""
+    ranges = []
+    while start < end:
+        ranges.append((start, min(end, start + chunk_seconds)))
+        start += chunk_seconds
+    return ranges
+
+
+def to_columns(rows):
+    """Convert historian `[[timestamp, value], ...]` rows to parallel lists of seconds and numbers.
+
+    Rows whose value is not a number (or boolean) are left out.
+    """
+    timestamps, values = [], []
+    for timestamp, value in rows:
+        if isinstance(value, (int, float)):
+            try:
+                # Historians return ISO 8601 with an offset, which is quickest to parse directly
+                timestamps.append(datetime.fromisoformat(timestamp).timestamp())
+            except (ValueError, TypeError):
+                timestamps.append(parse_time(timestamp))
+            values.append(float(value))
+    return timestamps, values
+
+
+def downsample(timestamps, values, start, bucket, aggregates=AGGREGATES):
+    """Aggregate time ordered samples into buckets of `bucket` seconds counted from `start`.
+
+    Returns columns: `timestamps` (bucket starts), `count` and one per aggregate, holding only
+    the buckets which have samples.
+    """
+    if numpy is not None:
+        return _downsample_numpy(timestamps, values, start, bucket, aggregates)
+
+    columns = {name: [] for name in ('timestamps', 'count') + tuple(aggregates)}
+    current = None
+    for timestamp, value in zip(timestamps, values):
+        index = int((timestamp - start) // bucket)
+        if index != current:
+            current = index
+            columns['timestamps'].append(start + index * bucket)
+            columns['count'].append(0)
+            for name in aggregates:
+                columns[name].append(value if name != 'avg' else 0.0)
+        columns['count'][-1] += 1
+        if 'min' in columns:
+            columns['min'][-1] = min(columns['min'][-1], value)
+        if 'max' in columns:
+            columns['max'][-1] = max(columns['max'][-1], value)
+        if 'avg' in columns:
+            columns['avg'][-1] += value
+        if 'last' in columns:
+            columns['last'][-1] = value
+    if 'avg' in columns:
+        columns['avg'] = [total / count for total, count in zip(columns['avg'], columns['count'])]
+    return columns
+
+
+def _downsample_numpy(timestamps, values, start, bucket, aggregates):
+    times = numpy.asarray(timestamps, dtype=numpy.float64)
+    samples = numpy.asarray(values, dtype=numpy.float64)
+    indices = numpy.floor_divide(times - start, bucket).astype(numpy.int64)
+    # Samples are in time order, so each bucket is a contiguous run starting where its index changes
+    buckets, starts = numpy.unique(indices, return_index=True)
+    counts = numpy.diff(numpy.append(starts, len(samples)))
+
+    columns = {'timestamps': (start + buckets * bucket).tolist(), 'count': counts.tolist()}
+    if not len(samples):
+        columns.update((name, []) for name in aggregates)
+        return columns
+    for name in aggregates:
+        if name == 'min':
+            columns[name] = numpy.minimum.reduceat(samples, starts).tolist()
+        elif name == 'max':
+            columns[name] = numpy.maximum.reduceat(samples, starts).tolist()
+        elif name == 'avg':
+            columns[name] = (numpy.add.reduceat(samples, starts) / counts).tolist()
+        elif name == 'last':
+            columns[name] = samples[starts + counts - 1].tolist()
+    return columns
@@ -0,0 +1,52 @@
+import time
+
+
+class LastValueStore(object):
+    """Latest point values published by the platform drivers, kept by platform and device.
+
+    Values are stored per device as published on `devices/<device>/all`, along with the time
+    they were received, so readers can decide whether they are recent enough to use.
+    """
+
+    def __init__(self):
+        self._devices = {}  # (platform, device) -> (values, received_at)
+
+    def update(self, platform, device, values, received_at=None):
+        """Record the values of all points on a device.
+
+        Returns a dict of the points whose value changed (all of them for a new device).
+        """
+        received_at = time.time() if received_at is None else received_at
+        current = self._devices.get((platform, device))
+        if current is not None and current[1] > received_at:
+            return {}
+        self._devices[(platform, device)] = (dict(values), received_at)
+        if current is None:
+            return dict(values)
+        previous = current[0]
+        return {point: value for point, value in values.items()
+                if point not in previous or previous[point] != value}
+
+    def get_device(self, platform, device, max_age=None):
+        """Return `(values, received_at)` for a device, or None if unknown or older than max_age."""
+        entry = self._devices.get((platform, device))
+        if entry is None or (max_age is not None and time.time() - entry[1] > max_age):
+            return None
+        return entry
+
+    def get_point(self, platform, device, point, max_age=None):
+        """Return `(value, received_at)` for a point, or None if unknown or older than max_age."""
+        entry = self.get_device(platform, device, max_age)
+        if entry is None or point not in entry[0]:
+            return None
+        return entry[0][point], entry[1]
+
+    def remove_device(self, platform, device):
+        self._devices.pop((platform, device), None)
+
+    def remove_platform(self, platform):
+        for key in [k for k in self._devices if k[0] == platform]:
+            del self._devices[key]
+
+    def __len__(self):
+        return len(self._devices)
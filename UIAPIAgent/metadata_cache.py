@@ -0,0 +1,152 @@
+import logging
+import time
+
+import gevent
+
+_log = logging.getLogger(__name__)
+
+# Seconds an entry is considered fresh, by entry kind (first element of the key).
+DEFAULT_TTLS = {
+    'peerlist':   10,
+    'agent_uuid': 300,
+    'devices':    30,
+}
+
+
+class MetadataCache(object):
+    """Cache for platform metadata: peer lists, agent UUIDs and device hierarchies.
+
+    Keys are tuples whose first element is the entry kind and whose second element, if any, is
+    the platform name, e.g. ``('peerlist',)``, ``('agent_uuid', 'volttron1', 'platform.driver')``
+    or ``('devices', 'volttron1')``.
+
+    An entry older than its kind's ttl is still served for up to `max_stale` seconds while a
+    single background greenlet reloads it. Anything older is reloaded before returning. A ttl
+    of 0 disables caching for that kind.
+
+    Each entry carries a generation number which only changes when a reload returns a different
+    value, so callers can tell whether anything derived from an entry is still current.
+    """
+
+    def __init__(self, max_stale=60, **ttls):
+        self.ttls = dict(DEFAULT_TTLS)
+        self.max_stale = 0
+        self._entries = {}      # key -> (value, loaded_at, generation)
+        self._generation = 0
+        self._refreshing = {}   # key -> greenlet
+        self.configure(max_stale=max_stale, **ttls)
+
+    def configure(self, max_stale=None, **ttls):
+        """Update ttls (given as `<kind>_ttl=<seconds>`) and the stale window.
+
+        Raises ValueError for unknown kinds or negative values; nothing is applied in that case.
+        """
+        new_ttls = dict(self.ttls)
+        for name, value in ttls.items():
+            kind = name[:-len('_ttl')] if name.endswith('_ttl') else name
+            if kind not in DEFAULT_TTLS:
+                raise ValueError(f"Unknown metadata cache setting '{name}'")
+            new_ttls[kind] = float(value)
+        new_max_stale = self.max_stale if max_stale is None else float(max_stale)
+        if new_max_stale < 0 or any(ttl < 0 for ttl in new_ttls.values()):
+            raise ValueError("Metadata cache ttls must not be negative")
+
+        self.ttls = new_ttls
+        self.max_stale = new_max_stale
+        # Entries of kinds no longer cached would otherwise linger with stale generations
+        for key in [k for k in self._entries if self.ttls.get(k[0], 0) <= 0]:
+            self.invalidate(key)
+
+    def get(self, key, loader):
+        """Return the cached value for `key`, calling `loader()` to (re)load it when needed."""
+        ttl = self.ttls.get(key[0], 0)
+        if ttl <= 0:
+            return loader()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, loaded_at, _generation = entry
+            age = time.time() - loaded_at
+            if age < ttl:
+                return value
+            if age < ttl + self.max_stale:
+                self._refresh_in_background(key, loader)
+                return value
+
+        return self._load(key, loader)
+
+    def peek(self, key):
+        """Return the cached value for `key` regardless of age, or None."""
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def generation(self, key):
+        """Return the generation of the cached value for `key`, or None if not cached."""
+        entry = self._entries.get(key)
+        return entry[2] if entry is not None else None
+
+    def invalidate(self, key):
+        """Drop a single entry and cancel any refresh in progress for it."""
+        self._entries.pop(key, None)
+        greenlet = self._refreshing.pop(key, None)
+        if greenlet is not None:
+            greenlet.kill(block=False)
+
+    def invalidate_platform(self, platform):
+        """Drop every entry belonging to `platform`."""
+        for key in [k for k in list(self._entries) + list(self._refreshing)
+                    if len(k) > 1 and k[1] == platform]:
+            self.invalidate(key)
+
+    def clear(self):
+        for key in list(self._entries) + list(self._refreshing):
+            self.invalidate(key)
+
+    def snapshot(self):
+        """Return the cached entries as `[key, value]` lists, which `restore` takes back."""
+        return [[list(key), value] for key, (value, _loaded_at, _generation) in self._entries.items()]
+
+    def restore(self, entries):
+        """Add entries saved with `snapshot`, keeping any already cached.
+
+        Restored entries are due a reload straight away, so they are served while the first use
+        of each reloads it in the background (or loaded in the foreground if `max_stale` is 0).
+        """
+        now = time.time()
+        restored = 0
+        for key, value in entries:
+            key = tuple(key)
+            ttl = self.ttls.get(key[0], 0)
+            if ttl <= 0 or key in self._entries:
+                continue
+            self._generation += 1
+            self._entries[key] = (value, now - ttl, self._generation)
+            restored += 1
+        return restored
+
+    def _load(self, key, loader):
+        loaded_at = time.time()
+        value = loader()
+        previous = self._entries.get(key)
+        if previous is not None and previous[0] == value:
+            generation = previous[2]
+        else:
+            self._generation += 1
+            generation = self._generation
+        self._entries[key] = (value, loaded_at, generation)
+        return value
+
+    def _refresh_in_background(self, key, loader):
+        if key in self._refreshing:
+            return
+
+        def refresh():
+            try:
+                self._load(key, loader)
+            except Exception as e:
+                _log.warning(f"Background refresh of {key} failed: {e}")
+            finally:
+                if self._refreshing.get(key) is gevent.getcurrent():
+                    del self._refreshing[key]
+
+        self._refreshing[key] = gevent.spawn(refresh)
@@ -0,0 +1,185 @@
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+
+import gevent
+import gevent.local
+
+_log = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Label sets kept per metric. Labels such as method names may come from clients, so further
+# label sets are counted under a single one with every label set to OTHER.
+MAX_SERIES = 1000
+OTHER = '_other'
+
+# name -> (type, help text)
+METRICS = {
+    'uiapi_request_seconds':      ('histogram', "Time spent handling API requests."),
+    'uiapi_request_errors_total': ('counter', "API requests which failed or returned an error status."),
+    'uiapi_rpc_seconds':          ('histogram', "Time spent in outbound calls to the platforms."),
+    'uiapi_rpc_errors_total':     ('counter', "Outbound calls to the platforms which failed."),
+    'uiapi_rpc_coalesced_total':  ('counter', "Outbound reads answered by an identical call in flight or just made."),
+    'uiapi_rpc_hedged_total':     ('counter', "Outbound reads repeated for being slow to answer."),
+    'uiapi_auth_seconds':         ('histogram', "Time spent verifying login credentials."),
+    'uiapi_serialize_seconds':    ('histogram', "Time spent encoding response bodies."),
+    'uiapi_admission_rejected_total': ('counter', "Requests turned away for being over a token or platform limit."),
+    'uiapi_published_total':      ('counter', "Messages published or rejected through bulk publish."),
+}
+
+
+class _Trace(object):
+    """Timings of the hops taken while handling a single request."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.status = None
+        self.hops = []  # (hop name, seconds)
+
+
+class Metrics(object):
+    """Request and RPC latency histograms and error counters.
+
+    Hops timed while a request is being handled are also collected into a per-request trace,
+    and requests taking longer than `slow_request_threshold` seconds (0 disables) are logged
+    with that breakdown. Greenlets spawned on behalf of a request should run functions wrapped
+    with `bind` so their hops are attributed to it.
+    """
+
+    def __init__(self, slow_request_threshold=0):
+        self.slow_request_threshold = slow_request_threshold
+        self._histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+        self._counters = {}    # (name, labels) -> value
+        self._series = {}      # name -> number of label sets kept
+        self._local = gevent.local.local()
+
+    def configure(self, slow_request_threshold=0):
+        slow_request_threshold = float(slow_request_threshold)
+        if slow_request_threshold < 0:
+            raise ValueError("slow_request_threshold must not be negative")
+        self.slow_request_threshold = slow_request_threshold
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(self._histograms, name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            histogram[0][index] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(self._counters, name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def _key(self, series, name, labels):
+        """Return the key of a series in `series`, folding new label sets into OTHER once
+        `name` has MAX_SERIES of them."""
+        key = (name, tuple(sorted(labels.items())))
+        if key in series:
+            return key
+        if self._series.get(name, 0) >= MAX_SERIES:
+            return (name, tuple((label, OTHER) for label, _value in key[1]))
+        self._series[name] = self._series.get(name, 0) + 1
+        return key
+
+    @contextmanager
+    def time_request(self, endpoint):
+        """Time a request to `endpoint`, yielding its trace so the handler can set `status`."""
+        trace = _Trace(endpoint)
+        parent = getattr(self._local, 'trace', None)
+        self._local.trace = trace
+        start = time.time()
+        try:
+            yield trace
+        except Exception:
+            trace.status = '500 Internal Server Error'
+            raise
+        finally:
+            elapsed = time.time() - start
+            self._local.trace = parent
+            self.observe('uiapi_request_seconds', elapsed, endpoint=endpoint)
+            if trace.status and not trace.status.startswith(('2', '3')):
+                self.inc('uiapi_request_errors_total', endpoint=endpoint)
+            if self.slow_request_threshold and elapsed > self.slow_request_threshold:
+                _log.warning(f"Slow request to {endpoint} ({trace.status}) took {elapsed:.3f}s: "
+                             + (', '.join(f"{hop} {seconds:.3f}s" for hop, seconds in trace.hops)
+                                or "no hops"))
+
+    @contextmanager
+    def time_rpc(self, platform, method):
+        """Time an outbound call of `method` on `platform`."""
+        start = time.time()
+        try:
+            yield
+        except gevent.GreenletExit:
+            # Abandoned rather than failed
+            raise
+        except BaseException:
+            self.inc('uiapi_rpc_errors_total', platform=platform, method=method)
+            raise
+        finally:
+            elapsed = time.time() - start
+            self.observe('uiapi_rpc_seconds', elapsed, platform=platform, method=method)
+            self._add_hop(f"{method}@{platform}" if platform else method, elapsed)
+
+    @contextmanager
+    def time_serialize(self, endpoint):
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.observe('uiapi_serialize_seconds', elapsed, endpoint=endpoint)
+            self._add_hop('serialize', elapsed)
+
+    def bind(self, function):
+        """Wrap `function` so hops it times in another greenlet count towards the current request."""
+        trace = getattr(self._local, 'trace', None)
+
+        def bound(*args, **kwargs):
+            self._local.trace = trace
+            return function(*args, **kwargs)
+        return bound
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, (metric_type, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == 'histogram':
+                for (metric, labels), (buckets, total, count) in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(BUCKETS, buckets):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_labels(labels, le=repr(bound))} {cumulative}")
+                    lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {total}")
+                    lines.append(f"{name}_count{_labels(labels)} {count}")
+            else:
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def _add_hop(self, hop, seconds):
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace.hops.append((hop, seconds))
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for _name, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _value), value in zip(pairs, escaped)) + '}'
@@ -0,0 +1,96 @@
+import base64
+import itertools
+import json
+
+from .encoding import dumps
+
+# Fields of a device record in the hierarchy which may be selected with `fields`
+DEVICE_FIELDS = ('points', 'health', 'last_publish_utc')
+
+
+def parse_page_params(params):
+    """Read `limit`, `cursor`, `fields` and `stream` from query parameters.
+
+    Returns a dict with `limit` (int or None), `cursor` ((platform, device) or None), `fields`
+    (tuple or None) and `stream` (bool). Raises ValueError for malformed values.
+    """
+    limit = params.get('limit')
+    if limit is not None:
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError("limit must be a positive integer")
+
+    fields = params.get('fields')
+    if fields is not None:
+        fields = tuple(field for field in fields.split(',') if field)
+        unknown = set(fields) - set(DEVICE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields {sorted(unknown)}, expected some of {DEVICE_FIELDS}")
+
+    cursor = params.get('cursor')
+    if cursor:
+        cursor = decode_cursor(cursor)
+
+    stream = params.get('stream', '').lower() in ('1', 'true', 'yes')
+    return {'limit': limit, 'cursor': cursor or None, 'fields': fields, 'stream': stream}
+
+
+def encode_cursor(platform, device):
+    return base64.urlsafe_b64encode(json.dumps([platform, device]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        platform, device = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(platform), str(device)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def iter_devices(hierarchy, after=None):
+    """Yield (platform, device, DeviceRecord) from a hierarchy of PlatformDevices in platform
+    then device order.
+
+    If `after` is a (platform, device) cursor, start with the entry following it.
+    """
+    for platform in sorted(hierarchy):
+        if after is not None and platform < after[0]:
+            continue
+        records = hierarchy[platform].records(after[1] if after is not None and
+                                              platform == after[0] else None)
+        for record in records:
+            yield platform, record.topic, record
+
+
+def take_page(entries, limit):
+    """Return up to `limit` entries (all if None) and the cursor of the next page, if any."""
+    if limit is None:
+        return list(entries), None
+    page = list(itertools.islice(entries, limit + 1))
+    if len(page) <= limit:
+        return page, None
+    platform, device, _record = page[limit - 1]
+    return page[:limit], encode_cursor(platform, device)
+
+
+def iter_json_object(items):
+    """Encode (key, value) pairs as a JSON object one member at a time.
+
+    Values which are themselves iterators of (key, value) pairs are encoded as nested objects
+    the same way, so a document can be written out without ever being built as a whole.
+    """
+    yield '{'
+    for index, (key, value) in enumerate(items):
+        yield (', ' if index else '') + dumps(key) + ': '
+        if isinstance(value, (dict, list, str, int, float, bool)) or value is None:
+            yield dumps(value)
+        else:
+            yield from iter_json_object(value)
+    yield '}'
+
+
+def build_json_object(items):
+    """Build (key, value) pairs, as taken by iter_json_object, into a dict."""
+    return {key: value if isinstance(value, (dict, list, str, int, float, bool)) or value is None
+            else build_json_object(value)
+            for key, value in items}
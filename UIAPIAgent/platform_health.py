@@ -0,0 +1,127 @@
+import time
+from collections import deque
+
+# Breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """A platform's breaker is open; calls may be tried again after `retry_after` seconds."""
+
+    def __init__(self, platform, retry_after):
+        super(CircuitOpen, self).__init__(f"Platform '{platform}' is unavailable (circuit open)")
+        self.platform = platform
+        self.retry_after = retry_after
+
+
+class UnknownPlatform(Exception):
+    """A platform which is not connected was named, so no call or breaker is made for it."""
+
+    def __init__(self, platform):
+        super(UnknownPlatform, self).__init__(f"Platform '{platform}' is not connected")
+        self.platform = platform
+
+
+class _Breaker(object):
+    """Call outcomes and latencies of one platform."""
+
+    def __init__(self, latency_window):
+        self.state = CLOSED
+        self.failures = 0       # consecutive failures
+        self.opened_at = None
+        self.probe_at = None    # when the call probing a half open breaker started
+        self.last_error = None
+        self.latencies = deque(maxlen=latency_window)  # seconds of recent successful calls
+
+
+class PlatformHealth(object):
+    """A circuit breaker per platform, with the latency of recent calls.
+
+    After `failure_threshold` consecutive failed calls a platform's breaker opens and calls to
+    it fail fast with CircuitOpen. Once `reset_timeout` seconds have passed a single call is let
+    through to probe it (half open): the breaker closes if it succeeds and opens again if not.
+    A probe which has not finished within `reset_timeout` seconds is given up on, letting
+    another one through.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, latency_window=100):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_window = latency_window
+        self._breakers = {}  # platform -> _Breaker
+
+    def configure(self, failure_threshold=5, reset_timeout=30, latency_window=100):
+        failure_threshold, latency_window = int(failure_threshold), int(latency_window)
+        reset_timeout = float(reset_timeout)
+        if failure_threshold < 1 or reset_timeout <= 0 or latency_window < 1:
+            raise ValueError("Circuit breaker settings must be positive")
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        if latency_window != self.latency_window:
+            for breaker in self._breakers.values():
+                breaker.latencies = deque(breaker.latencies, maxlen=latency_window)
+        self.latency_window = latency_window
+
+    def before_call(self, platform):
+        """Raise CircuitOpen if calls to `platform` should fail fast, else let the call go ahead."""
+        breaker = self._breaker(platform)
+        if breaker.state == CLOSED:
+            return
+        now = time.time()
+        if breaker.state == OPEN:
+            retry_after = breaker.opened_at + self.reset_timeout - now
+            if retry_after > 0:
+                raise CircuitOpen(platform, retry_after)
+            breaker.state = HALF_OPEN
+        elif now - breaker.probe_at < self.reset_timeout:
+            raise CircuitOpen(platform, breaker.probe_at + self.reset_timeout - now)
+        breaker.probe_at = now
+
+    def record_success(self, platform, seconds):
+        breaker = self._breaker(platform)
+        breaker.latencies.append(seconds)
+        breaker.failures = 0
+        breaker.state = CLOSED
+
+    def record_failure(self, platform, error):
+        breaker = self._breaker(platform)
+        breaker.failures += 1
+        breaker.last_error = str(error) or error.__class__.__name__
+        if breaker.state == HALF_OPEN or breaker.failures >= self.failure_threshold:
+            breaker.state = OPEN
+            breaker.opened_at = time.time()
+
+    def latency(self, platform, fraction):
+        """Return the `fraction` quantile of recent call latencies, or None if there are none."""
+        breaker = self._breakers.get(platform)
+        if breaker is None or not breaker.latencies:
+            return None
+        latencies = sorted(breaker.latencies)
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    def status(self, platforms=()):
+        """Return the breaker state and recent latency of `platforms` and all platforms called."""
+        now = time.time()
+        report = {}
+        for platform in list(platforms) + [p for p in self._breakers if p not in platforms]:
+            breaker = self._breaker(platform)
+            report[platform] = {
+                'state': breaker.state,
+                'failures': breaker.failures,
+                'last_error': breaker.last_error,
+                'retry_in': (max(0.0, round(breaker.opened_at + self.reset_timeout - now, 3))
+                             if breaker.state == OPEN else None),
+                'latency': {'p50': self.latency(platform, 0.5), 'p95': self.latency(platform, 0.95),
+                            'samples': len(breaker.latencies)}}
+        return report
+
+    def forget(self, platform):
+        self._breakers.pop(platform, None)
+
+    def _breaker(self, platform):
+        breaker = self._breakers.get(platform)
+        if breaker is None:
+            breaker = self._breakers[platform] = _Breaker(self.latency_window)
+        return breaker
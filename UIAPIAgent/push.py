@@ -0,0 +1,138 @@
+import fnmatch
+import json
+import logging
+import re
+import time
+import uuid
+
+import gevent
+
+_log = logging.getLogger(__name__)
+
+
+class PushClient(object):
+    """A subscriber to point changes, matching `<platform>/<device>/<point>` topics by glob."""
+
+    def __init__(self, client_id, path, patterns):
+        self.id = client_id
+        self.path = path
+        self.created = time.time()
+        self.connected = False
+        self.dropped = 0
+        self.pending = {}   # topic -> latest value not yet sent
+        self._flush = None  # greenlet sending `pending`, if scheduled
+        self.set_patterns(patterns)
+
+    def set_patterns(self, patterns):
+        self.patterns = list(patterns)
+        self._regex = re.compile('|'.join(fnmatch.translate(p) for p in self.patterns) or '(?!)')
+        self._matches = {}  # topic -> bool
+
+    def matches(self, topic):
+        match = self._matches.get(topic)
+        if match is None:
+            match = self._matches[topic] = self._regex.match(topic) is not None
+        return match
+
+
+class PushHub(object):
+    """Fans point changes out to push clients.
+
+    Changes for a client are coalesced for `window` seconds and then sent together, keeping only
+    the latest value of each point. While a send is in progress new changes keep coalescing, so a
+    slow client receives fewer, larger updates rather than a growing backlog. At most
+    `max_pending` points are held per client; beyond that the oldest are dropped.
+
+    `send(path, message)` delivers a message to the client connected at `path`, and
+    `unregister(path)` is called once a client is removed. Clients which have not connected
+    within `connect_timeout` seconds are removed as well.
+    """
+
+    def __init__(self, send, unregister, path_prefix, window=0.5, max_pending=1000,
+                 max_clients=1000, connect_timeout=60):
+        self._send = send
+        self._unregister = unregister
+        self.path_prefix = path_prefix
+        self.window = window
+        self.max_pending = max_pending
+        self.max_clients = max_clients
+        self.connect_timeout = connect_timeout
+        self._clients = {}  # path -> PushClient
+
+    def configure(self, window=0.5, max_pending=1000, max_clients=1000, connect_timeout=60):
+        window, connect_timeout = float(window), float(connect_timeout)
+        max_pending, max_clients = int(max_pending), int(max_clients)
+        if window < 0 or connect_timeout <= 0 or max_pending < 1 or max_clients < 1:
+            raise ValueError("Push window must not be negative, other push settings positive")
+        self.window = window
+        self.max_pending = max_pending
+        self.max_clients = max_clients
+        self.connect_timeout = connect_timeout
+
+    def add_client(self, patterns):
+        """Create a client for `patterns`. Raises ValueError if there are too many clients."""
+        self._expire_unconnected()
+        if len(self._clients) >= self.max_clients:
+            raise ValueError("Too many push clients")
+        client_id = str(uuid.uuid4())
+        client = PushClient(client_id, f"{self.path_prefix}/{client_id}", patterns)
+        self._clients[client.path] = client
+        return client
+
+    def get_client(self, path):
+        return self._clients.get(path)
+
+    def remove_client(self, path):
+        client = self._clients.pop(path, None)
+        if client is None:
+            return None
+        if client._flush is not None:
+            client._flush.kill(block=False)
+        try:
+            self._unregister(path)
+        except Exception as e:
+            _log.warning(f"Failed to unregister push client {client.id}: {e}")
+        return client
+
+    def clients(self):
+        return list(self._clients.values())
+
+    def publish(self, platform, device, changes):
+        """Queue changed point values of a device for every client subscribed to them."""
+        prefix = f"{platform}/{device}/"
+        for client in list(self._clients.values()):
+            if not client.connected:
+                continue
+            for point, value in changes.items():
+                topic = prefix + point
+                if not client.matches(topic):
+                    continue
+                client.pending.pop(topic, None)
+                client.pending[topic] = value
+                if len(client.pending) > self.max_pending:
+                    client.pending.pop(next(iter(client.pending)))
+                    client.dropped += 1
+            if client.pending and client._flush is None:
+                client._flush = gevent.spawn_later(self.window, self._flush, client)
+
+    def _flush(self, client):
+        try:
+            while client.pending and client.path in self._clients:
+                values, client.pending = client.pending, {}
+                try:
+                    self._send(client.path, json.dumps({'timestamp': time.time(), 'values': values}))
+                except Exception as e:
+                    _log.warning(f"Dropping push client {client.id}: {e}")
+                    client._flush = None
+                    self.remove_client(client.path)
+                    return
+                if client.pending:
+                    gevent.sleep(self.window)
+        finally:
+            client._flush = None
+
+    def _expire_unconnected(self):
+        now = time.time()
+        for client in self.clients():
+            if not client.connected and now - client.created > self.connect_timeout:
+                self.remove_client(client.path)
@@ -0,0 +1,79 @@
+import time
+
+import gevent
+import gevent.event
+
+
+class SingleFlight(object):
+    """Coalesces concurrent identical calls so that only one of them runs.
+
+    Callers passing the same key while a call is in flight wait for it and share its result or
+    exception. Results may also be kept for `micro_cache_ttl` seconds after the call returns,
+    so that bursts of identical reads are answered without calling again.
+
+    Keys are tuples starting with the platform and device (or None) the call concerns, so
+    cached results can be dropped with `forget` once something changes them.
+    """
+
+    def __init__(self, micro_cache_ttl=0):
+        self.micro_cache_ttl = micro_cache_ttl
+        self._calls = {}    # key -> AsyncResult of the call in flight
+        self._results = {}  # key -> (value, expires_at)
+        self._purge_at = 1024
+
+    def configure(self, micro_cache_ttl=0):
+        micro_cache_ttl = float(micro_cache_ttl)
+        if micro_cache_ttl < 0:
+            raise ValueError("micro_cache_ttl must not be negative")
+        self.micro_cache_ttl = micro_cache_ttl
+        self._results.clear()
+
+    def do(self, key, function):
+        """Return `function()`, or the result of an identical call in flight or just made.
+
+        The call runs in a greenlet of its own, so a caller which times out or is killed while
+        waiting only stops waiting: the others still get the call's result.
+
+        Returns a tuple of the result and whether it was shared rather than computed here.
+        """
+        result = self._results.get(key)
+        if result is not None:
+            if result[1] > time.time():
+                return result[0], True
+            del self._results[key]
+
+        call = self._calls.get(key)
+        if call is not None:
+            return call.get(), True
+
+        call = self._calls[key] = gevent.event.AsyncResult()
+        gevent.spawn(self._run, key, call, function)
+        return call.get(), False
+
+    def _run(self, key, call, function):
+        try:
+            value = function()
+        except BaseException as e:
+            call.set_exception(e)
+            return
+        finally:
+            del self._calls[key]
+
+        if self.micro_cache_ttl:
+            self._results[key] = (value, time.time() + self.micro_cache_ttl)
+            if len(self._results) > self._purge_at:
+                self._purge()
+        call.set(value)
+
+    def _purge(self):
+        """Drop expired results, which are otherwise only dropped when asked for again."""
+        now = time.time()
+        for key in [k for k, (_, expires_at) in self._results.items() if expires_at <= now]:
+            del self._results[key]
+        self._purge_at = max(1024, 2 * len(self._results))
+
+    def forget(self, platform, device=None):
+        """Drop cached results for a device, or for a whole platform if no device is given."""
+        for key in [k for k in self._results
+                    if k[0] == platform and (device is None or k[1] == device)]:
+            del self._results[key]
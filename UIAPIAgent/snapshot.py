@@ -0,0 +1,40 @@
+import json
+import logging
+import os
+import time
+
+from .encoding import dumps
+
+_log = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(path, contents):
+    """Write `contents` (JSON serializable) to `path`, replacing any previous snapshot atomically."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as snapshot_file:
+        snapshot_file.write(dumps({'version': SNAPSHOT_VERSION, 'saved_at': time.time(),
+                                   'contents': contents}))
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path, max_age=None):
+    """Return the contents saved to `path`, or None if there are none, or they are unreadable or
+    older than `max_age` seconds."""
+    try:
+        with open(path) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        _log.warning(f"Ignoring unreadable snapshot '{path}': {e}")
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        _log.warning(f"Ignoring snapshot '{path}' of an unknown version")
+        return None
+    age = time.time() - snapshot.get('saved_at', 0)
+    if max_age is not None and age > max_age:
+        _log.info(f"Ignoring snapshot '{path}' saved {age:.0f}s ago")
+        return None
+    return snapshot.get('contents')
@@ -1,31 +1,165 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
 import uuid
+from collections import OrderedDict
+
+_log = logging.getLogger(__name__)
+
 
 class TokenHandler(object):
-    def __init__(self):
-        self.active_tokens = {}
+    """Issues and validates API tokens.
+
+    Tokens are indexed by token value, so validation is a dict lookup. A token expires `ttl`
+    seconds after it was issued or `idle_timeout` seconds after it was last used (0 disables
+    either), and once more than `max_tokens` are active the least recently used ones are
+    evicted.
+
+    If `persist_path` is set, tokens are also kept in a SQLite file there and reloaded on start.
+    Credentials are only ever stored as a salted hash.
+    """
+
+    def __init__(self, ttl=86400, idle_timeout=3600, max_tokens=10000, persist_path=None):
+        self.ttl = ttl
+        self.idle_timeout = idle_timeout
+        self.max_tokens = max_tokens
+        self.persist_path = None
+
+        self._tokens = OrderedDict()  # token -> [credentials key, created, last used], LRU first
+        self._keys = {}               # credentials key -> token
+        self._salt = os.urandom(16).hex()
+        self._db = None
+
+        self.configure(ttl, idle_timeout, max_tokens, persist_path)
+
+    def configure(self, ttl=86400, idle_timeout=3600, max_tokens=10000, persist_path=None):
+        ttl, idle_timeout, max_tokens = float(ttl), float(idle_timeout), int(max_tokens)
+        if ttl < 0 or idle_timeout < 0 or max_tokens < 1:
+            raise ValueError("Token ttl and idle_timeout must not be negative, max_tokens positive")
+
+        if persist_path != self.persist_path:
+            self._open(persist_path)
+        self.ttl = ttl
+        self.idle_timeout = idle_timeout
+        self.max_tokens = max_tokens
+        self._evict()
 
     def generate_token(self, username, password):
-        key = (username, password)
+        key = self._key(username, password)
         auth_token = str(uuid.uuid4())
+        now = time.time()
+
+        old_token = self._keys.pop(key, None)
+        if old_token is not None:
+            self._tokens.pop(old_token, None)
+        self._keys[key] = auth_token
+        self._tokens[auth_token] = [key, now, now]
 
-        self.active_tokens[key] = auth_token
+        if self._db is not None:
+            with self._db:
+                self._db.execute("DELETE FROM tokens WHERE key = ?", (key,))
+                self._db.execute("INSERT INTO tokens VALUES (?, ?, ?)", (auth_token, key, now))
+        self._evict()
         return auth_token
 
     def retrieve_token(self, username, password):
-        key = (username, password)
-        
-        try:
-            return self.active_tokens[key]
-        except:
+        token = self._keys.get(self._key(username, password))
+        if token is None or not self._touch(token):
             return None
+        return token
 
     def validate_token(self, token):
-        return token in self.active_tokens.values()
+        return self._touch(token)
 
     def remove_token(self, username, password):
-        key = (username, password)
-        try:
-            self.active_tokens.pop(key)
-            return True
-        except KeyError:
+        token = self._keys.get(self._key(username, password))
+        if token is None:
+            return False
+        self._discard(token)
+        return True
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def _key(self, username, password):
+        credentials = '\0'.join([self._salt, username, password])
+        return hashlib.sha256(credentials.encode('utf-8')).hexdigest()
+
+    def _touch(self, token):
+        """Mark a token as used, returning False (and dropping it) if it has expired."""
+        entry = self._tokens.get(token)
+        if entry is None:
             return False
+
+        now = time.time()
+        if self._expired(entry, now):
+            self._discard(token)
+            return False
+        entry[2] = now
+        self._tokens.move_to_end(token)
+        return True
+
+    def _expired(self, entry, now):
+        _key, created, last_used = entry
+        return ((self.ttl and now - created > self.ttl) or
+                (self.idle_timeout and now - last_used > self.idle_timeout))
+
+    def _evict(self):
+        """Drop expired tokens, then the least recently used ones above max_tokens."""
+        now = time.time()
+        for token in [t for t, entry in self._tokens.items() if self._expired(entry, now)]:
+            self._discard(token)
+        while len(self._tokens) > self.max_tokens:
+            self._discard(next(iter(self._tokens)))
+
+    def _discard(self, token):
+        key = self._tokens.pop(token)[0]
+        if self._keys.get(key) == token:
+            del self._keys[key]
+        if self._db is not None:
+            with self._db:
+                self._db.execute("DELETE FROM tokens WHERE token = ?", (token,))
+
+    def _open(self, persist_path):
+        """Switch persistence to `persist_path` (None to disable), loading any stored tokens."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        self.persist_path = persist_path
+        if not persist_path:
+            return
+
+        try:
+            self._db = sqlite3.connect(persist_path)
+            self._load()
+        except sqlite3.Error as e:
+            self._db = None
+            self.persist_path = None
+            raise ValueError(f"Cannot use token store '{persist_path}': {e}")
+        _log.info(f"Loaded {len(self._tokens)} tokens from {persist_path}")
+
+    def _load(self):
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS tokens "
+                             "(token TEXT PRIMARY KEY, key TEXT UNIQUE, created REAL)")
+            row = self._db.execute("SELECT value FROM meta WHERE name = 'salt'").fetchone()
+            if row is None:
+                self._db.execute("INSERT INTO meta VALUES ('salt', ?)", (self._salt,))
+                self._db.execute("DELETE FROM tokens")
+                self._db.executemany("INSERT INTO tokens VALUES (?, ?, ?)",
+                                     [(token, entry[0], entry[1])
+                                      for token, entry in self._tokens.items()])
+            elif row[0] != self._salt:
+                # Tokens issued so far were keyed with another salt and cannot be carried over
+                self._salt = row[0]
+                self._tokens.clear()
+                self._keys.clear()
+
+        # Idle time restarts on load, so clients are not all logged out by a restart
+        now = time.time()
+        for token, key, created in self._db.execute("SELECT token, key, created FROM tokens"):
+            self._tokens[token] = [key, created, now]
+            self._keys[key] = token
@@ -0,0 +1,123 @@
+import logging
+import time
+import uuid
+from collections import OrderedDict
+
+import gevent
+import gevent.event
+
+_log = logging.getLogger(__name__)
+
+
+class WriteTicket(object):
+    """A requested point write, which clients can poll or wait on until it is resolved.
+
+    `status` is one of 'pending', 'done', 'failed' or 'superseded' (a later write to the same
+    point replaced it before it was sent, see `superseded_by`).
+    """
+
+    def __init__(self, platform, device, point, value):
+        self.id = str(uuid.uuid4())
+        self.platform = platform
+        self.device = device
+        self.point = point
+        self.value = value
+        self.status = 'pending'
+        self.error = None
+        self.superseded_by = None
+        self.created = time.time()
+        self.resolved = None
+        self._event = gevent.event.Event()
+
+    def resolve(self, status, error=None, superseded_by=None):
+        self.status = status
+        self.error = error
+        self.superseded_by = superseded_by
+        self.resolved = time.time()
+        self._event.set()
+
+    def wait(self, timeout=None):
+        """Wait until resolved, returning False if `timeout` passed first."""
+        return self._event.wait(timeout)
+
+    def to_dict(self):
+        response = {'ticket': self.id, 'platform': self.platform, 'device': self.device,
+                    'point': self.point, 'value': self.value,
+                    'type': self.value.__class__.__name__, 'status': self.status}
+        if self.error is not None:
+            response['error'] = self.error
+        if self.superseded_by is not None:
+            response['superseded_by'] = self.superseded_by
+        return response
+
+
+class WritePipeline(object):
+    """Debounces and batches point writes per device.
+
+    Writes are held for `window` seconds. A later write to a point that is still held replaces
+    the earlier one (last writer wins), then every held point of the device is sent in one call
+    to `write_device(platform, device, [(point, value), ...])`, which returns a dict of errors
+    by point. Only one call per device is in flight at a time; writes arriving meanwhile are
+    held for the next one. Resolved tickets are kept for `ticket_ttl` seconds.
+    """
+
+    def __init__(self, write_device, window=0.1, ticket_ttl=300):
+        self._write_device = write_device
+        self.window = window
+        self.ticket_ttl = ticket_ttl
+        self._pending = {}   # (platform, device) -> OrderedDict of point -> WriteTicket
+        self._flushing = {}  # (platform, device) -> greenlet writing the device
+        self._tickets = OrderedDict()  # ticket id -> WriteTicket, oldest first
+
+    def configure(self, window=0.1, ticket_ttl=300):
+        window, ticket_ttl = float(window), float(ticket_ttl)
+        if window < 0 or ticket_ttl <= 0:
+            raise ValueError("Write window must not be negative, ticket_ttl positive")
+        self.window = window
+        self.ticket_ttl = ticket_ttl
+
+    def submit(self, platform, device, point, value):
+        """Queue a write, returning its ticket."""
+        self._expire_tickets()
+        ticket = WriteTicket(platform, device, point, value)
+        self._tickets[ticket.id] = ticket
+
+        key = (platform, device)
+        pending = self._pending.setdefault(key, OrderedDict())
+        replaced = pending.pop(point, None)
+        if replaced is not None:
+            replaced.resolve('superseded', superseded_by=ticket.id)
+        pending[point] = ticket
+
+        if key not in self._flushing:
+            self._flushing[key] = gevent.spawn_later(self.window, self._flush, key)
+        return ticket
+
+    def get(self, ticket_id):
+        return self._tickets.get(ticket_id)
+
+    def _flush(self, key):
+        try:
+            while self._pending.get(key):
+                tickets = list(self._pending.pop(key).values())
+                try:
+                    errors = self._write_device(key[0], key[1],
+                                                [(t.point, t.value) for t in tickets]) or {}
+                except Exception as e:
+                    _log.warning(f"Writing {len(tickets)} points of {key[1]} on {key[0]} failed: {e}")
+                    errors = {t.point: str(e) or e.__class__.__name__ for t in tickets}
+                for ticket in tickets:
+                    error = errors.get(ticket.point)
+                    ticket.resolve('failed' if error else 'done', error=error)
+                if self._pending.get(key):
+                    gevent.sleep(self.window)
+        finally:
+            self._flushing.pop(key, None)
+
+    def _expire_tickets(self):
+        cutoff = time.time() - self.ticket_ttl
+        while self._tickets:
+            ticket = next(iter(self._tickets.values()))
+            if ticket.status == 'pending' or ticket.resolved > cutoff:
+                break
+            del self._tickets[ticket.id]
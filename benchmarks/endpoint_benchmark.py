@@ -0,0 +1,367 @@
+"""
+Load test of the UI API endpoint handlers against stand-in platforms.
+
+The agent is built on fake VIP subsystems: each platform is simulated by a stand-in VCP agent
+and platform driver which answer `get_devices`, `list_agents` and the routed driver methods
+after an injected latency, so no message bus or real devices are needed. Handlers are called
+directly, as the web service would, from a pool of concurrent greenlets.
+
+Run from the root of this repository inside the VOLTTRON environment, e.g.::
+
+    python -m benchmarks.endpoint_benchmark --platforms 12 --devices 50 --points 20 \\
+        --latency 0.05 --concurrency 32 --requests 2000 hierarchy devices all point write \\
+        history publish auth
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import random
+import time
+import zlib
+
+import gevent
+import gevent.event
+import gevent.pool
+from volttron.platform.agent.known_identities import (PLATFORM_ACTUATOR, PLATFORM_DRIVER,
+                                                      PLATFORM_HISTORIAN)
+from volttron.platform.vip.agent import Agent
+
+from UIAPIAgent.agent import Uiapiagent
+from UIAPIAgent.encoding import dumps
+from UIAPIAgent.history import format_time, parse_time
+
+
+class FakeResult(object):
+    """Stands in for the AsyncResult of an RPC call, answering after `latency` seconds."""
+
+    def __init__(self, function, latency):
+        self._function = function
+        self._latency = latency
+
+    def get(self, timeout=None):
+        with gevent.Timeout(timeout):
+            gevent.sleep(self._latency)
+            return self._function()
+
+
+class FakePlatform(object):
+    """A remote platform: its VCP agent, driver, actuator and historian, with simulated devices.
+
+    The historian holds a value of every point each `history_interval` seconds.
+    """
+
+    def __init__(self, name, devices, points, latency, jitter, history_interval=60, down=False):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.driver_uuid = f"{name}-driver-uuid"
+        self.actuator_uuid = f"{name}-actuator-uuid"
+        self.historian_uuid = f"{name}-historian-uuid"
+        self.history_interval = history_interval
+        self.down = down
+        self.point_names = [f"point{p}" for p in range(points)]
+        self.device_names = [f"campus/building{d // 10}/device{d}" for d in range(devices)]
+        self.values = {device: {point: random.random() * 100 for point in self.point_names}
+                       for device in self.device_names}
+
+    def delay(self):
+        if self.down:
+            return 3600.0
+        return max(0.0, random.gauss(self.latency, self.jitter))
+
+    def call(self, method, *args):
+        if method == 'get_devices':
+            return {f"devices/{device}": {
+                        "points": list(self.point_names),
+                        "health": {"status": "GOOD", "context": None,
+                                   "last_updated": "2020-04-02T01:39:10.025729+00:00"},
+                        "last_publish_utc": "2020-04-02T01:39:10.025580+00:00"}
+                    for device in self.device_names}
+        if method == 'list_agents':
+            return [{"identity": PLATFORM_DRIVER, "uuid": self.driver_uuid},
+                    {"identity": PLATFORM_ACTUATOR, "uuid": self.actuator_uuid},
+                    {"identity": PLATFORM_HISTORIAN, "uuid": self.historian_uuid}]
+        if method == 'route_to_agent_method':
+            _request_id, agent_method, params = args
+            if self.actuator_uuid in agent_method:
+                return self.call_actuator(agent_method.rsplit('.', 1)[-1], *params)
+            if self.historian_uuid in agent_method:
+                return self.query_historian(*params)
+            return self.call_driver(agent_method.rsplit('.', 1)[-1], *params)
+        raise ValueError(f"Stand-in platform has no method '{method}'")
+
+    def call_driver(self, method, device, *args):
+        values = self.values[device]
+        if method == 'scrape_all':
+            return dict(values)
+        if method == 'get_point':
+            return values[args[0]]
+        if method == 'set_point':
+            values[args[0]] = args[1]
+            return args[1]
+        if method == 'get_multiple_points':
+            return {f"{device}/{point}": values[point] for point in args[0]}, {}
+        if method == 'set_multiple_points':
+            for point, value in args[0]:
+                values[point] = value
+            return {}
+        raise ValueError(f"Stand-in driver has no method '{method}'")
+
+    def query_historian(self, topic, start, end, _agg_type, _agg_period, skip, count, _order):
+        first = -(-parse_time(start) // self.history_interval) * self.history_interval
+        times = range(int(first), int(parse_time(end)), int(self.history_interval))
+        rows = [[format_time(t), 50 + 25 * random.random()] for t in times[skip:skip + count]]
+        return {'values': rows, 'metadata': {}}
+
+    def call_actuator(self, method, _requester_id, *args):
+        if method == 'request_new_schedule':
+            return {'result': 'SUCCESS', 'data': {}, 'info': ''}
+        if method == 'set_multiple_points':
+            for topic, value in args[0]:
+                device, point = topic.rsplit('/', 1)
+                self.values[device][point] = value
+            return {}
+        raise ValueError(f"Stand-in actuator has no method '{method}'")
+
+
+class FakeRPC(object):
+
+    def __init__(self, platforms):
+        self.platforms = platforms
+        self.calls = 0
+
+    def call(self, peer, method, *args, **kwargs):
+        self.calls += 1
+        platform = self.platforms[peer.split('.')[0]]
+        return FakeResult(lambda: platform.call(method, *args), platform.delay())
+
+
+class FakeSignal(object):
+
+    def connect(self, receiver):
+        pass
+
+
+class FakePeerList(object):
+
+    def __init__(self, platforms):
+        self.platforms = platforms
+        self.onadd = FakeSignal()
+        self.ondrop = FakeSignal()
+
+    def __call__(self):
+        peers = [f"{name}.platform.agent" for name in self.platforms]
+        return FakeResult(lambda: peers, 0.0005)
+
+
+class FakePubSub(object):
+
+    def subscribe(self, *args, **kwargs):
+        return FakeResult(lambda: None, 0)
+
+    unsubscribe = subscribe
+
+    def publish(self, *args, **kwargs):
+        # Publishes are acknowledged by the local router, so quickly, whether waited on or not
+        result = gevent.event.AsyncResult()
+        gevent.spawn_later(0.0005, result.set, None)
+        return result
+
+
+class FakeConfigStore(object):
+
+    def set_default(self, config_name, contents):
+        pass
+
+    def subscribe(self, callback, actions=None, pattern=None):
+        pass
+
+
+class FakeVIP(object):
+
+    def __init__(self, platforms):
+        self.rpc = FakeRPC(platforms)
+        self.peerlist = FakePeerList(platforms)
+        self.pubsub = FakePubSub()
+        self.config = FakeConfigStore()
+
+
+class FakeCore(object):
+    identity = 'uiapi-benchmark'
+    instance_name = 'benchmark'
+
+
+class FakeBusAgent(Agent):
+    """Takes the place of `Agent.__init__` in the MRO, installing fake subsystems."""
+
+    def __init__(self, fake_vip=None, **kwargs):
+        self.vip = fake_vip
+        self.core = FakeCore()
+
+
+class BenchmarkAgent(Uiapiagent, FakeBusAgent):
+    pass
+
+
+def response_body(response):
+    """Decode the body of an endpoint's `[status, base64 body, headers]` response."""
+    body = base64.b64decode(response[1])
+    encoding = dict(response[2]).get('Content-Encoding')
+    if encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif encoding == 'deflate':
+        body = zlib.decompress(body)
+    return body.decode('utf-8')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Scenario(object):
+    """Builds requests for one endpoint handler."""
+
+    def __init__(self, agent, platforms, token, max_age, accept_encoding=None):
+        self.agent = agent
+        self.platforms = list(platforms.values())
+        self.headers = {'HTTP_AUTHORIZATION': f"BASIC {token}"}
+        if accept_encoding:
+            self.headers['HTTP_ACCEPT_ENCODING'] = accept_encoding
+        self.query = '' if max_age is None else f"max_age={max_age}"
+
+    def env(self, path, method='GET'):
+        return dict(self.headers, PATH_INFO=path, REQUEST_METHOD=method, QUERY_STRING=self.query,
+                    HTTP_HOST='localhost', REMOTE_ADDR='127.0.0.1')
+
+    def random_device(self):
+        platform = random.choice(self.platforms)
+        return platform, random.choice(platform.device_names)
+
+    def hierarchy(self):
+        return self.agent.endpoint_devices_hierarchy(self.env('/devices/hierarchy'), {})
+
+    def devices(self):
+        return self.agent.endpoint_devices_list(self.env('/devices'), {})
+
+    def all(self):
+        platform, device = self.random_device()
+        return self.agent.endpoint_device_or_point(
+            self.env(f"/devices/{platform.name}/{device}/all"), {})
+
+    def point(self):
+        platform, device = self.random_device()
+        point = random.choice(platform.point_names)
+        return self.agent.endpoint_device_or_point(
+            self.env(f"/devices/{platform.name}/{device}/pt/{point}"), {})
+
+    def write(self):
+        platform, device = self.random_device()
+        point = random.choice(platform.point_names)
+        return self.agent.endpoint_device_or_point(
+            self.env(f"/devices/{platform.name}/{device}/pt/{point}", 'POST'),
+            {'value': random.random() * 100})
+
+    def history(self):
+        platform, device = self.random_device()
+        point = random.choice(platform.point_names)
+        env = self.env(f"/devices/{platform.name}/{device}/pt/{point}/history")
+        env['QUERY_STRING'] = f"start={time.time() - 7 * 86400}&bucket=1h"
+        return self.agent.endpoint_device_or_point(env, {})
+
+    def publish(self):
+        # A bulk publish of 1000 messages over 20 topics
+        body = '\n'.join(dumps({'topic': f"record/bench/topic{line % 20}", 'message': {'value': line}})
+                         for line in range(1000))
+        return self.agent.endpoint_bulk_publish(self.env('/bus/publish', 'POST'), body)
+
+    def auth(self):
+        user = f"user{random.randrange(100)}"
+        return self.agent.handle_auth(self.env('/auth', 'POST'),
+                                      {'username': user, 'password': 'password'})
+
+
+def run(agent, request, concurrency, count):
+    """Issue `count` requests from `concurrency` greenlets, returning timings and errors."""
+    latencies = []
+    errors = [0]
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            response = request()
+            if isinstance(response, list) and not response[0].startswith('2'):
+                errors[0] += 1
+        except Exception:
+            errors[0] += 1
+        latencies.append(time.perf_counter() - start)
+
+    rpc_calls = agent.vip.rpc.calls
+    start = time.perf_counter()
+    gevent.pool.Pool(concurrency).map(one, range(count))
+    elapsed = time.perf_counter() - start
+    return sorted(latencies), errors[0], elapsed, agent.vip.rpc.calls - rpc_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    # Scenarios are checked after parsing, since argparse before Python 3.12 checks an empty
+    # list of them against `choices` as a whole
+    scenarios = ['hierarchy', 'devices', 'all', 'point', 'write', 'history', 'publish', 'auth']
+    parser.add_argument('scenarios', nargs='*', default=None,
+                        help="any of " + ', '.join(scenarios) +
+                             " (default: hierarchy devices all point)")
+    parser.add_argument('--platforms', type=int, default=4)
+    parser.add_argument('--devices', type=int, default=20, help="devices per platform")
+    parser.add_argument('--points', type=int, default=10, help="points per device")
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="mean seconds per stand-in RPC call")
+    parser.add_argument('--jitter', type=float, default=0.005,
+                        help="standard deviation of the RPC latency")
+    parser.add_argument('--down', type=int, default=0,
+                        help="number of platforms which never answer")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500, help="requests per scenario")
+    parser.add_argument('--gzip', action='store_true',
+                        help="send Accept-Encoding: gzip with every request")
+    parser.add_argument('--max-age', type=float, default=None,
+                        help="max_age query parameter for point reads (0 always scrapes)")
+    parser.add_argument('--config', type=json.loads, default={},
+                        help="agent configuration overrides, as JSON")
+    args = parser.parse_args()
+    args.scenarios = args.scenarios or ['hierarchy', 'devices', 'all', 'point']
+    unknown = [name for name in args.scenarios if name not in scenarios]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    platforms = {f"volttron{p}": FakePlatform(f"volttron{p}", args.devices, args.points,
+                                              args.latency, args.jitter, down=p < args.down)
+                 for p in range(args.platforms)}
+    agent = BenchmarkAgent(fake_vip=FakeVIP(platforms))
+    agent.configure('config', 'NEW', args.config)
+
+    token = json.loads(response_body(agent.handle_auth(
+        {'REQUEST_METHOD': 'POST'}, {'username': 'benchmark', 'password': 'benchmark'})))['token']
+    scenario = Scenario(agent, platforms, token, args.max_age, 'gzip' if args.gzip else None)
+
+    print(f"{args.platforms} platforms x {args.devices} devices x {args.points} points, "
+          f"{args.latency * 1000:.1f}ms RPC latency, concurrency {args.concurrency}")
+    print(f"{'scenario':<10} {'requests':>8} {'errors':>6} {'req/s':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rpc/req':>8}")
+    for name in args.scenarios:
+        latencies, errors, elapsed, rpc_calls = run(agent, getattr(scenario, name),
+                                                    args.concurrency, args.requests)
+        print(f"{name:<10} {len(latencies):>8} {errors:>6} {len(latencies) / elapsed:>9.1f} "
+              f"{percentile(latencies, 0.50) * 1000:>8.2f} "
+              f"{percentile(latencies, 0.95) * 1000:>8.2f} "
+              f"{percentile(latencies, 0.99) * 1000:>8.2f} "
+              f"{rpc_calls / len(latencies):>8.2f}")
+
+
+if __name__ == '__main__':
+    main()